@@ -56,17 +56,66 @@
 __version__ = '0.0'
 
 __all__ = ['MIME_TYPE_TEXT', 'MIME_TYPE_PNG_IMAGE', 'MIME_TYPE_JPG_IMAGE',
-           'MIME_TYPE_APPLICATION', 'Attachment', 'Message', 'EmailServer',
-           'cli']
+           'MIME_TYPE_APPLICATION', 'Attachment', 'Message', 'SendResult',
+           'EmailServer', 'AsyncEmailServer', 'MessageTemplate', 'FanOut',
+           'Spool', 'SpoolWorker', 'RateLimiter', 'RelayGroup', 'RetryPolicy',
+           'Metrics', 'MetricsRecorder', 'cli']
+
+import sys
+import types
 
 from email_lib.constants import (MIME_TYPE_TEXT,
                                  MIME_TYPE_PNG_IMAGE,
                                  MIME_TYPE_JPG_IMAGE,
                                  MIME_TYPE_APPLICATION)
 
-from email_lib.lib import (Attachment,
-                           Message,
-                           EmailServer)
-
-from email_lib.ui import (cli)
-
+''' The module each of the other names comes from. Modules are only imported
+    when one of their names is first used, so importing the package is cheap
+    (e.g., the command-line interface, and the asynchronous server, aren't
+    loaded unless they're needed). '''
+_LAZY_NAMES = {'Attachment'       : 'email_lib.lib',
+               'Message'          : 'email_lib.lib',
+               'SendResult'       : 'email_lib.lib',
+               'EmailServer'      : 'email_lib.lib',
+               'AsyncEmailServer' : 'email_lib.async_server',
+               'MessageTemplate'  : 'email_lib.template',
+               'FanOut'           : 'email_lib.fanout',
+               'Spool'            : 'email_lib.spool',
+               'SpoolWorker'      : 'email_lib.spool',
+               'RateLimiter'      : 'email_lib.ratelimit',
+               'RelayGroup'       : 'email_lib.relay',
+               'RetryPolicy'      : 'email_lib.retry',
+               'Metrics'          : 'email_lib.metrics',
+               'MetricsRecorder'  : 'email_lib.metrics',
+               'cli'              : 'email_lib.ui'}
+
+class _LazyPackage (types.ModuleType) :
+    ''' The package's module, which imports the names in <_LAZY_NAMES> the
+        first time they're looked up. '''
+
+    def __getattr__ (self, name) :
+        try :
+            module_name = _LAZY_NAMES[name]
+        except KeyError :
+            raise AttributeError("'module' object has no attribute '%s'"
+                                 % name)
+
+        __import__(module_name)
+        value = getattr(sys.modules[module_name], name)
+
+        # Later lookups don't come through here.
+        setattr(self, name, value)
+
+        return value
+
+    def __dir__ (self) :
+        return sorted(set(self.__dict__) | set(_LAZY_NAMES))
+
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(globals())
+
+# The original module is kept alive, since its functions' globals belong to
+# it.
+_package._original = sys.modules[__name__]
+
+sys.modules[__name__] = _package
@@ -0,0 +1,527 @@
+''' This module contains an asynchronous version of the <EmailServer> class,
+    which speaks SMTP over non-blocking sockets driven by an <asyncore> event
+    loop. This allows a large number of deliveries to be in flight at once
+    from a single thread. '''
+
+
+import sys
+import ssl
+import time
+import socket
+import base64
+import smtplib
+import asyncore
+import asynchat
+
+import email_lib.constants as constants
+import email_lib.iso_time as iso_time
+import email_lib.lib as lib
+import email_lib.transport as transport
+
+__all__ = ['AsyncEmailServer']
+
+CRLF = '\r\n'
+
+''' Replies which mean a command was accepted. '''
+OK_CODES = {'MAIL' : (250,),
+            'RCPT' : (250, 251),
+            'DATA' : (354,),
+            'END'  : (250,)}
+
+class _Session (asynchat.async_chat) :
+    ''' A single SMTP connection. A session keeps sending messages taken from
+        its <_Delivery> until there are none left, or until the connection
+        fails. Each reply from the server is handed to <self._on_reply>,
+        which moves the session on to its next state. '''
+
+    def __init__ (self, delivery, item) :
+        asynchat.async_chat.__init__(self, map=delivery.map)
+
+        self.delivery = delivery
+        self.server   = delivery.server
+        self.features = {}
+
+        self._item      = item
+        self._buffer    = []
+        self._lines     = []
+        self._on_reply  = self._on_greeting
+        self._is_tls    = False
+        self._want_tls  = False
+        self._want_write_tls = False
+
+        self.last_activity = time.time()
+
+        self.set_terminator(CRLF)
+
+        family, type_, proto, _, address = delivery.address
+        self.create_socket(family, type_)
+        self.connect(address)
+
+    # Socket handling.
+
+    def recv (self, buffer_size) :
+        if not self._is_tls :
+            return asynchat.async_chat.recv(self, buffer_size)
+
+        try :
+            data = self.socket.recv(buffer_size)
+        except ssl.SSLError as exception :
+            if exception.args[0] in (ssl.SSL_ERROR_WANT_READ,
+                                     ssl.SSL_ERROR_WANT_WRITE) :
+                return ''
+            raise
+
+        if not data :
+            self.handle_close()
+
+        return data
+
+    def send (self, data) :
+        if not self._is_tls :
+            return asynchat.async_chat.send(self, data)
+
+        try :
+            return self.socket.send(data)
+        except ssl.SSLError as exception :
+            if exception.args[0] in (ssl.SSL_ERROR_WANT_READ,
+                                     ssl.SSL_ERROR_WANT_WRITE) :
+                return 0
+            raise
+
+    def writable (self) :
+        if self._want_tls :
+            return self._want_write_tls
+
+        return asynchat.async_chat.writable(self)
+
+    def handle_connect (self) :
+        # Nothing is sent until the server's greeting arrives.
+        pass
+
+    def handle_read (self) :
+        self.last_activity = time.time()
+
+        if self._want_tls :
+            self._do_handshake()
+            return
+
+        asynchat.async_chat.handle_read(self)
+
+        # Decrypted data can be buffered by the SSL layer, where <select>
+        # doesn't see it.
+        while self._is_tls and self.socket.pending() :
+            asynchat.async_chat.handle_read(self)
+
+    def handle_write (self) :
+        self.last_activity = time.time()
+
+        if self._want_tls :
+            self._do_handshake()
+        else :
+            asynchat.async_chat.handle_write(self)
+
+    def handle_close (self) :
+        self._fail(smtplib.SMTPServerDisconnected('Connection unexpectedly '
+                                                  'closed'))
+
+    def handle_error (self) :
+        self._fail(sys.exc_info()[1])
+
+    def collect_incoming_data (self, data) :
+        self._buffer.append(data)
+
+    def found_terminator (self) :
+        line = ''.join(self._buffer)
+        self._buffer = []
+
+        self._lines.append(line[4:].strip())
+        if line[3:4] == '-' :
+            # This is a multi-line reply.
+            return
+
+        try :
+            code = int(line[:3])
+        except ValueError :
+            code = -1
+
+        lines = self._lines
+        self._lines = []
+
+        self._on_reply(code, lines)
+
+    def _command (self, command, on_reply) :
+        self._on_reply = on_reply
+        # Unicode addresses are encoded the same way <smtplib> encodes them.
+        self.push(str(command) + CRLF)
+
+    def _fail (self, exception) :
+        ''' This closes the session. The message being sent (if there is one)
+            fails with <exception>. '''
+
+        if self._item is not None :
+            index, message = self._item
+            self._item = None
+            self.delivery.record(index, lib.SendResult(message,
+                                                       exception=exception))
+
+        self._close()
+
+    def _close (self) :
+        self.close()
+        self.delivery.session_closed(self)
+
+    # Connection set up.
+
+    def _on_greeting (self, code, lines) :
+        if code != 220 :
+            self._fail(smtplib.SMTPConnectError(code, '\n'.join(lines)))
+        else :
+            self._command('EHLO %s' % self.delivery.local_hostname,
+                          self._on_ehlo)
+
+    def _on_ehlo (self, code, lines) :
+        if code != 250 :
+            self._fail(smtplib.SMTPHeloError(code, '\n'.join(lines)))
+            return
+
+        self.features = {}
+        for line in lines[1:] :
+            keyword, _, params = line.partition(' ')
+            self.features[keyword.lower()] = params.strip()
+
+        if self._is_tls :
+            self._log_in()
+        elif 'starttls' in self.features :
+            self._command('STARTTLS', self._on_starttls)
+        else :
+            self._fail(smtplib.SMTPException('STARTTLS extension not '
+                                             'supported by server.'))
+
+    def _on_starttls (self, code, lines) :
+        if code != 220 :
+            self._fail(smtplib.SMTPException('\n'.join(lines)))
+            return
+
+        self.del_channel()
+        self.set_socket(ssl.wrap_socket(self.socket,
+                                        do_handshake_on_connect=False),
+                        map=self.delivery.map)
+        self._is_tls   = True
+        self._want_tls = True
+        self._do_handshake()
+
+    def _do_handshake (self) :
+        try :
+            self.socket.do_handshake()
+        except ssl.SSLError as exception :
+            if exception.args[0] == ssl.SSL_ERROR_WANT_READ :
+                self._want_write_tls = False
+            elif exception.args[0] == ssl.SSL_ERROR_WANT_WRITE :
+                self._want_write_tls = True
+            else :
+                raise
+        else :
+            self._want_tls = False
+            self._command('EHLO %s' % self.delivery.local_hostname,
+                          self._on_ehlo)
+
+    def _log_in (self) :
+        username = self.server.username
+        password = self.server.password
+
+        if username is None or password is None :
+            self._start_transaction()
+            return
+
+        username = unicode(username).encode(constants.UTF)
+        password = unicode(password).encode(constants.UTF)
+
+        mechanisms = self.features.get('auth', '').upper().split()
+        if 'PLAIN' in mechanisms :
+            token = base64.b64encode('\0%s\0%s' % (username, password))
+            self._command('AUTH PLAIN %s' % token, self._on_auth)
+        elif 'LOGIN' in mechanisms :
+            def on_password (code, lines) :
+                if code != 334 :
+                    self._on_auth(code, lines)
+                else :
+                    self._command(base64.b64encode(password), self._on_auth)
+
+            def on_username (code, lines) :
+                if code != 334 :
+                    self._on_auth(code, lines)
+                else :
+                    self._command(base64.b64encode(username), on_password)
+
+            self._command('AUTH LOGIN', on_username)
+        else :
+            self._fail(smtplib.SMTPException('No suitable authentication '
+                                             'method found.'))
+
+    def _on_auth (self, code, lines) :
+        if code != 235 :
+            self._fail(ValueError("Couldn't log into the server with the "
+                                  'credentials given.'))
+        else :
+            self._start_transaction()
+
+    # Message transactions.
+
+    def _start_transaction (self) :
+        index, message = self._item
+
+        try :
+            message.from_
+            message.to
+            message.make
+        except AttributeError :
+            self._finish(AttributeError('The <AsyncEmailServer> class can '
+                                        'only send <Message> objects.'))
+            return
+
+        self._from    = message.from_
+        self._to      = list(lib._recipients_of(message))
+        self._literal = str(message)
+        self._refused = {}
+        self._pending = list(self._to)
+
+        self._command('MAIL FROM:%s' % smtplib.quoteaddr(self._from),
+                      self._on_mail)
+
+    def _on_mail (self, code, lines) :
+        if code not in OK_CODES['MAIL'] :
+            self._finish(smtplib.SMTPSenderRefused(code, '\n'.join(lines),
+                                                   self._from))
+        else :
+            self._next_recipient()
+
+    def _next_recipient (self) :
+        if self._pending :
+            self._command('RCPT TO:%s' % smtplib.quoteaddr(self._pending[0]),
+                          self._on_rcpt)
+        elif len(self._refused) == len(self._to) :
+            self._finish(smtplib.SMTPRecipientsRefused(self._refused))
+        else :
+            self._command('DATA', self._on_data)
+
+    def _on_rcpt (self, code, lines) :
+        recipient = self._pending.pop(0)
+        if code not in OK_CODES['RCPT'] :
+            self._refused[recipient] = (code, '\n'.join(lines))
+
+        self._next_recipient()
+
+    def _on_data (self, code, lines) :
+        if code not in OK_CODES['DATA'] :
+            self._finish(smtplib.SMTPDataError(code, '\n'.join(lines)))
+            return
+
+        # The message stays a byte string, and is quoted in one pass, as
+        # <EmailServer> sends it.
+        self._on_reply = self._on_data_end
+        self.push(transport.quote(self._literal))
+
+    def _on_data_end (self, code, lines) :
+        if code not in OK_CODES['END'] :
+            self._finish(smtplib.SMTPDataError(code, '\n'.join(lines)))
+        else :
+            index, message = self._item
+            info = (message, self._from, self._to, self._literal,
+                    self._refused, iso_time.iso_date_time())
+            self.server.hist.add(info)
+
+            self._finish(None)
+
+    def _finish (self, exception) :
+        ''' This records the outcome of the current message, then moves on to
+            the next one. A failed transaction is reset first. '''
+
+        index, message = self._item
+        if exception is None :
+            result = lib.SendResult(message, self._refused)
+        else :
+            result = lib.SendResult(message, exception=exception)
+
+        self._item = None
+        self.delivery.record(index, result)
+
+        if exception is None :
+            self._next_message()
+        else :
+            self._command('RSET', lambda code, lines : self._next_message())
+
+    def _next_message (self) :
+        self._item = self.delivery.next_message()
+
+        if self._item is None :
+            self._command('QUIT', lambda code, lines : self._close())
+        else :
+            self._start_transaction()
+
+class _Delivery (object) :
+    ''' This hands out messages to sessions, and collects the results. New
+        sessions are opened as old ones close, for as long as there are
+        messages left. '''
+
+    def __init__ (self, server, messages, concurrency, callback, map) :
+        self.server      = server
+        self.callback    = callback
+        self.map         = map
+        self.concurrency = concurrency
+
+        self.results  = {}
+        self.failure  = None
+
+        # <asyncore.dispatcher> hashes by its socket, which changes when TLS
+        # is started, so sessions are tracked by their identity instead.
+        self.sessions = {}
+
+        self.address        = server._address()
+        self.local_hostname = server.local_hostname
+
+        self._messages  = enumerate(messages)
+        self._exhausted = False
+
+        for _ in xrange(concurrency) :
+            if not self._open_session() :
+                break
+
+    def next_message (self) :
+        if self._exhausted :
+            return None
+
+        try :
+            return next(self._messages)
+        except StopIteration :
+            self._exhausted = True
+        except Exception as exception :
+            # The iterable failed, which <send> raises once the sessions
+            # already running have finished.
+            self.failure    = exception
+            self._exhausted = True
+
+        return None
+
+    def _open_session (self) :
+        while True :
+            item = self.next_message()
+            if item is None :
+                return False
+
+            try :
+                session = _Session(self, item)
+            except socket.error as exception :
+                index, message = item
+                self.record(index, lib.SendResult(message,
+                                                  exception=exception))
+            else :
+                self.sessions[id(session)] = session
+                return True
+
+    def record (self, index, result) :
+        self.results[index] = result
+
+        if self.callback is not None :
+            self.callback(result)
+
+    def session_closed (self, session) :
+        if self.sessions.pop(id(session), None) is not None :
+            self._open_session()
+
+    def check_timeouts (self, timeout) :
+        ''' This fails any session which hasn't heard from the server in
+            <timeout> seconds. '''
+
+        now = time.time()
+        for session in self.sessions.values() :
+            if now - session.last_activity > timeout :
+                session._fail(socket.timeout('The server took too long to '
+                                             'reply.'))
+
+    def is_done (self) :
+        return self._exhausted and not self.sessions
+
+    def ordered_results (self) :
+        return [self.results[index] for index in sorted(self.results)]
+
+class AsyncEmailServer (object) :
+    ''' This class sends messages over many concurrent SMTP connections, all
+        driven by a single <asyncore> event loop. Messages are rendered with
+        <Message.make>, just as they are with <EmailServer>.
+
+        <host>        : The hostname.
+        <port>        : The port number.
+        <username>    : The username for logging into the server (not always
+                        required).
+        <password>    : The password for logging into the server (not always
+                        required).
+        <record_hist> : If this option is true, then all of the message objects
+                        sent will be recorded in an iterable history object
+                        (<self.hist>).
+        <hist_store>  : Where the history is kept (see <EmailServer>).
+        <concurrency> : The number of connections used at once.
+        <timeout>     : The number of seconds to wait for a reply from the
+                        server before giving up on a connection. '''
+
+    _is_email_server = True
+
+    def __init__ (self, host, port, username=None, password=None,
+                  record_hist=False, hist_store=None, concurrency=10,
+                  timeout=60.0) :
+        self.host        = host
+        self.port        = port
+        self.username    = username
+        self.password    = password
+        self.concurrency = concurrency
+        self.timeout     = timeout
+
+        self.hist = lib._Hist(record=record_hist, store=hist_store)
+
+        self.local_hostname = socket.getfqdn()
+
+    def _address (self) :
+        ''' The host is only looked up once per batch, rather than once per
+            connection. '''
+
+        try :
+            return socket.getaddrinfo(str(self.host), int(self.port), 0,
+                                      socket.SOCK_STREAM)[0]
+        except socket.gaierror :
+            raise ValueError('Failed to connect, probably a bad hostname or '
+                             'port number.')
+
+    def send_async (self, messages, callback=None, map=None) :
+        ''' This starts sending <messages> on an event loop that the caller
+            runs, e.g., with <asyncore.loop(map=map)>, and returns straight
+            away. <callback> is called with a <SendResult> object as each
+            message is finished. The returned object's <is_done> method tells
+            when every message has been dealt with. '''
+
+        if hasattr(messages, '_is_message') :
+            # A single message is sent.
+            message  = messages
+            messages = [message]
+
+        if map is None :
+            map = asyncore.socket_map
+
+        return _Delivery(self, messages, max(1, int(self.concurrency)),
+                         callback, map)
+
+    def send (self, messages, callback=None) :
+        ''' Send an individual <Message> object, or an iterable of <Message>
+            objects, and wait until every one of them is finished. A list of
+            <SendResult> objects is returned, in the same order as
+            <messages>. '''
+
+        map      = {}
+        delivery = self.send_async(messages, callback, map)
+
+        while not delivery.is_done() :
+            asyncore.loop(timeout=1.0, use_poll=True, map=map, count=1)
+            delivery.check_timeouts(self.timeout)
+
+        if delivery.failure is not None :
+            raise delivery.failure
+
+        return delivery.ordered_results()
@@ -0,0 +1,16 @@
+''' The benchmark suite, which measures importing the package, making
+    messages, encoding attachments, and sending through a local SMTP sink
+    (<SMTPSink>). Run it with :
+
+        python -m email_lib.bench [--quick] [--output results.json]
+
+    and compare the JSON reports of different versions, with <--compare>. '''
+
+
+__all__ = ['SMTPSink', 'run', 'compare', 'regressions']
+
+from email_lib.bench.sink import (SMTPSink)
+
+from email_lib.bench.suite import (run,
+                                   compare,
+                                   regressions)
@@ -0,0 +1,95 @@
+''' The benchmark suite's command-line interface. The report is written as
+    JSON, and a summary is printed. With <--compare> the results are checked
+    against an earlier report, and the exit status is 1 if anything got
+    worse by more than the tolerance. '''
+
+
+import sys
+import json
+import argparse
+
+import email_lib.bench.suite as suite
+
+def _parse_arguments (arguments) :
+    parser = argparse.ArgumentParser(prog='python -m email_lib.bench',
+                                     description='Benchmark email_lib.')
+
+    parser.add_argument('--only', action='append',
+                        choices=['import', 'make', 'attachment', 'send'],
+                        help='run just this benchmark (can be repeated)')
+    parser.add_argument('--quick', action='store_true',
+                        help='use fewer repetitions, and smaller inputs')
+    parser.add_argument('--output', '-o',
+                        help='write the JSON report to this file')
+    parser.add_argument('--compare', metavar='REPORT',
+                        help='compare the results with an earlier report')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='the relative change counted as a regression')
+    parser.add_argument('--count', type=int,
+                        help='the number of messages sent per case')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="the sink's delay before each reply, in seconds")
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='the fraction of transactions the sink fails')
+    parser.add_argument('--tls', choices=['starttls', 'implicit', 'none'],
+                        default='starttls',
+                        help='how the connections are secured')
+    parser.add_argument('--max-idle', type=float,
+                        help='how long connections are kept open, in '
+                             'seconds (0 connects for every message)')
+
+    return parser.parse_args(arguments)
+
+def _summarize (result) :
+    parameters = ', '.join('%s=%s' % item
+                           for item in sorted(result['parameters'].items()))
+    metrics    = ', '.join('%s=%.4g' % item
+                           for item in sorted(result['metrics'].items())
+                           if item[1] is not None)
+
+    return '%-10s %s\n           %s' % (result['benchmark'], parameters,
+                                       metrics)
+
+def main (arguments=None) :
+    options = _parse_arguments(sys.argv[1:] if arguments is None
+                               else arguments)
+
+    send_options = {'latency'   : options.latency,
+                    'fail_rate' : options.fail_rate,
+                    'tls'       : None if options.tls == 'none'
+                                  else options.tls}
+    if options.count is not None :
+        send_options['count'] = options.count
+
+    if options.max_idle is not None :
+        send_options['max_idle'] = options.max_idle
+
+    report = suite.run(options.only or ('import', 'make', 'attachment',
+                                        'send'),
+                       quick=options.quick, **send_options)
+
+    for result in report['results'] :
+        print _summarize(result)
+
+    if options.output is not None :
+        with open(options.output, 'w') as report_file :
+            json.dump(report, report_file, indent=2, sort_keys=True)
+
+    if options.compare is not None :
+        with open(options.compare) as report_file :
+            old = json.load(report_file)
+
+        changes = suite.compare(old, report)
+        for benchmark, parameters, metric, old_value, new_value, change \
+                in changes :
+            print '%-10s %-22s %10.4g -> %10.4g  %+6.1f%%' % (
+                  benchmark, metric, old_value, new_value, change * 100)
+
+        if suite.regressions(changes, options.tolerance) :
+            print 'Regressions found.'
+            return 1
+
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
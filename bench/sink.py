@@ -0,0 +1,265 @@
+''' This module contains a local SMTP sink, which accepts (and throws away)
+    everything sent to it, so that sending can be measured without a real
+    server. Replies can be delayed, and failures can be injected. '''
+
+
+import os
+import ssl
+import time
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import SocketServer
+
+__all__ = ['SMTPSink']
+
+CRLF = '\r\n'
+
+def _make_certificate (directory) :
+    ''' This makes a self-signed certificate (and key) for <localhost> in
+        <directory>, with the <openssl> command, and returns their paths. '''
+
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile  = os.path.join(directory, 'key.pem')
+
+    command = ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+               '-days', '1', '-subj', '/CN=localhost',
+               '-keyout', keyfile, '-out', certfile]
+    try :
+        with open(os.devnull, 'wb') as devnull :
+            subprocess.check_call(command, stdout=devnull, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError) :
+        raise RuntimeError("Couldn't make a self-signed certificate with "
+                           'openssl, give the sink a <certfile> and '
+                           '<keyfile> instead.')
+
+    return certfile, keyfile
+
+class _SinkHandler (SocketServer.StreamRequestHandler) :
+    ''' A single SMTP session. '''
+
+    def setup (self) :
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.server.tls == 'implicit' :
+            self.request = self.server.context.wrap_socket(self.request,
+                                                           server_side=True)
+
+        SocketServer.StreamRequestHandler.setup(self)
+
+    def _reply (self, *lines) :
+        if self.server.latency :
+            time.sleep(self.server.latency)
+
+        reply = [('%d-%s' % line) for line in lines[:-1]]
+        reply.append('%d %s' % lines[-1])
+
+        self.wfile.write(CRLF.join(reply) + CRLF)
+        self.wfile.flush()
+
+    def _start_tls (self) :
+        self.request = self.server.context.wrap_socket(self.request,
+                                                       server_side=True)
+        self.rfile = self.request.makefile('rb', -1)
+        self.wfile = self.request.makefile('wb', 0)
+
+    def _read_data (self) :
+        ''' This returns the size of the message, or <None> if the client
+            hung up before the end of it. '''
+
+        size = 0
+        while True :
+            line = self.rfile.readline()
+            if not line :
+                return None
+            elif line == '.' + CRLF :
+                return size
+
+            size += len(line)
+
+    def handle (self) :
+        sink = self.server
+        sink._count('connections')
+
+        self._reply((220, 'localhost ESMTP sink'))
+
+        is_secure  = sink.tls == 'implicit'
+        recipients = 0
+        while True :
+            line = self.rfile.readline()
+            if not line :
+                return
+
+            command = line.strip().split(' ', 1)[0].upper()
+
+            if command in ('EHLO', 'HELO') :
+                extensions = [(250, 'localhost'), (250, 'PIPELINING'),
+                              (250, '8BITMIME'), (250, 'SIZE 0'),
+                              (250, 'AUTH PLAIN LOGIN')]
+                if sink.tls == 'starttls' and not is_secure :
+                    extensions.append((250, 'STARTTLS'))
+
+                extensions.append((250, 'SMTPUTF8'))
+                self._reply(*extensions)
+            elif command == 'STARTTLS' and sink.tls == 'starttls' :
+                self._reply((220, 'Ready to start TLS'))
+                self._start_tls()
+                is_secure = True
+            elif command == 'AUTH' :
+                if line.strip().upper() == 'AUTH LOGIN' :
+                    # The username and password are asked for in turn.
+                    self._reply((334, 'VXNlcm5hbWU6'))
+                    self.rfile.readline()
+                    self._reply((334, 'UGFzc3dvcmQ6'))
+                    self.rfile.readline()
+
+                self._reply((235, 'Authentication succeeded'))
+            elif command == 'MAIL' :
+                recipients = 0
+                self._reply((250, 'OK'))
+            elif command == 'RCPT' :
+                if sink._should_fail(sink.refuse_rate) :
+                    self._reply((450, 'Mailbox busy, try again later'))
+                else :
+                    recipients += 1
+                    self._reply((250, 'OK'))
+            elif command == 'DATA' :
+                if not recipients :
+                    self._reply((554, 'No valid recipients'))
+                    continue
+
+                self._reply((354, 'End data with <CR><LF>.<CR><LF>'))
+                size = self._read_data()
+
+                if size is None :
+                    # The message was cut off, so it isn't delivered.
+                    return
+                elif sink._should_fail(sink.disconnect_rate) :
+                    return
+                elif sink._should_fail(sink.fail_rate) :
+                    self._reply((451, 'Local error, try again later'))
+                else :
+                    sink._count('transactions')
+                    sink._count('recipients', recipients)
+                    sink._count('bytes', size)
+                    self._reply((250, 'Queued'))
+
+                recipients = 0
+            elif command in ('RSET', 'NOOP') :
+                recipients = 0
+                self._reply((250, 'OK'))
+            elif command == 'QUIT' :
+                self._reply((221, 'Bye'))
+                return
+            else :
+                self._reply((500, 'Command not recognized'))
+
+class SMTPSink (SocketServer.ThreadingMixIn, SocketServer.TCPServer) :
+    ''' An SMTP server which runs in a background thread, accepts any login,
+        and counts (rather than keeps) what it's sent. It can be used as a
+        context manager, which stops it afterwards.
+
+        <host>            : The address to listen on.
+        <port>            : The port to listen on, <0> picks a free one (see
+                            <self.port>).
+        <tls>             : <'starttls'> offers STARTTLS, <'implicit'> uses
+                            TLS from the start (like SMTPS), and <None>
+                            doesn't use TLS. The certificate is <certfile>
+                            and <keyfile>, a self-signed one is made if
+                            they aren't given.
+        <latency>         : The number of seconds each reply is delayed by.
+        <fail_rate>       : The fraction of transactions which get a 451
+                            reply after their data.
+        <refuse_rate>     : The fraction of recipients which get a 450 reply.
+        <disconnect_rate> : The fraction of transactions where the connection
+                            is dropped after the data.
+        <seed>            : The seed for the failures, so runs can be
+                            repeated. '''
+
+    allow_reuse_address = True
+    daemon_threads      = True
+    request_queue_size  = 512
+
+    def __init__ (self, host='127.0.0.1', port=0, tls='starttls',
+                  certfile=None, keyfile=None, latency=0.0, fail_rate=0.0,
+                  refuse_rate=0.0, disconnect_rate=0.0, seed=None) :
+        SocketServer.TCPServer.__init__(self, (host, port), _SinkHandler)
+
+        self.latency         = latency
+        self.fail_rate       = fail_rate
+        self.refuse_rate     = refuse_rate
+        self.disconnect_rate = disconnect_rate
+
+        self.tls        = tls
+        self.context    = None
+        self._directory = None
+        if tls is not None :
+            if certfile is None :
+                self._directory   = tempfile.mkdtemp(prefix='email_lib-')
+                certfile, keyfile = _make_certificate(self._directory)
+
+            self.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            self.context.load_cert_chain(certfile, keyfile)
+
+        self.stats = {'connections'  : 0,
+                      'transactions' : 0,
+                      'recipients'   : 0,
+                      'bytes'        : 0}
+
+        self._random = random.Random(seed)
+        self._lock   = threading.Lock()
+        self._thread = None
+
+    def __enter__ (self) :
+        return self.start()
+
+    def __exit__ (self, *exception) :
+        self.stop()
+
+    @property
+    def port (self) :
+        return self.server_address[1]
+
+    def _count (self, name, amount=1) :
+        with self._lock :
+            self.stats[name] += amount
+
+    def _should_fail (self, rate) :
+        if not rate :
+            return False
+
+        with self._lock :
+            return self._random.random() < rate
+
+    def reset (self) :
+        ''' This sets the counts back to zero. '''
+
+        with self._lock :
+            for name in self.stats :
+                self.stats[name] = 0
+
+    def start (self) :
+        ''' This starts serving in a background thread, and returns the
+            sink. '''
+
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def stop (self) :
+        ''' This stops serving, and removes any certificate made. '''
+
+        if self._thread is not None :
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+
+        self.server_close()
+
+        if self._directory is not None :
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
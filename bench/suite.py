@@ -0,0 +1,408 @@
+''' This module contains the benchmarks themselves. Each one returns a list of
+    results, which are plain dicts (so they can be written out as JSON), with
+    the benchmark's name, its parameters, and what was measured. '''
+
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import resource
+import subprocess
+import tempfile
+import platform
+import threading
+
+import email_lib
+import email_lib.lib as lib
+from email_lib.bench.sink import SMTPSink
+
+__all__ = ['bench_import', 'bench_make', 'bench_attachment', 'bench_send',
+           'run', 'compare', 'regressions']
+
+def _percentile (values, fraction) :
+    ''' <values> has to be sorted. '''
+
+    if not values :
+        return None
+
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+def _peak_memory () :
+    ''' The process' peak resident memory so far, in kilobytes. '''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin' :
+        # This is in bytes on OS X.
+        peak //= 1024
+
+    return peak
+
+def _result (name, parameters, **metrics) :
+    metrics['peak_memory_kb'] = _peak_memory()
+    return {'benchmark'  : name,
+            'parameters' : parameters,
+            'metrics'    : metrics}
+
+_CASE_SCRIPT = '''
+import sys, json
+import email_lib.bench.suite as suite
+print json.dumps(getattr(suite, sys.argv[1])(**json.loads(sys.argv[2])))
+'''
+
+def _isolated (case, **arguments) :
+    ''' This runs the function named <case>, which measures a single case
+        and returns its result, in a new interpreter. The peak memory in its
+        result is then the case's own, rather than the largest of every
+        case run before it. '''
+
+    output = subprocess.check_output([sys.executable, '-c', _CASE_SCRIPT,
+                                      case, json.dumps(arguments)])
+
+    return json.loads(output.splitlines()[-1])
+
+def _write_file (directory, size, name=None, is_text=False) :
+    ''' This writes <size> random bytes, or lines of text, to a file. '''
+
+    if name is None :
+        name = 'attachment-%d.%s' % (size, 'txt' if is_text else 'bin')
+
+    if is_text :
+        line    = 'The quick brown fox jumps over the lazy dog.\n'
+        content = (line * (size // len(line) + 1))[:size]
+    else :
+        content = os.urandom(size)
+
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as attachment_file :
+        attachment_file.write(content)
+
+    return path
+
+def _make_message (body_size, recipients, attachments=()) :
+    to = ['recipient%d@example.com' % index for index in xrange(recipients)]
+    return email_lib.Message('sender@example.com', to, u'Benchmark',
+                             u'x' * body_size, list(attachments))
+
+def _timed (function, repeat) :
+    ''' This calls <function> <repeat> times, and returns the sorted list of
+        how long each call took. '''
+
+    timings = []
+    for _ in xrange(repeat) :
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+
+    timings.sort()
+    return timings
+
+''' The statements timed by <bench_import>, each in a new interpreter. '''
+_IMPORTS = (('package', 'import email_lib'),
+            ('message', 'import email_lib; email_lib.Message'),
+            ('server',  'import email_lib; email_lib.EmailServer'),
+            ('all',     'from email_lib import *'))
+
+_IMPORT_SCRIPT = '''
+import sys, time
+modules = len(sys.modules)
+start   = time.time()
+%s
+print time.time() - start, len(sys.modules) - modules
+'''
+
+def bench_import (repeat=10) :
+    ''' This measures how long importing the package takes, and how many
+        modules it loads, for a few typical uses. Each import is timed in a
+        new interpreter, so nothing is imported already. '''
+
+    results = []
+    for name, statement in _IMPORTS :
+        timings = []
+        for _ in xrange(repeat) :
+            output = subprocess.check_output([sys.executable, '-c',
+                                              _IMPORT_SCRIPT % statement])
+            seconds, modules = output.split()
+            timings.append(float(seconds))
+
+        timings.sort()
+
+        parameters = {'statement' : name,
+                      'repeat'    : repeat}
+
+        results.append(_result('import', parameters,
+                               median=_percentile(timings, 0.5),
+                               best=timings[0], modules=int(modules)))
+
+    return results
+
+def bench_make (body_sizes=(1024, 100 * 1024), recipient_counts=(1, 100),
+                attachment_counts=(0, 1, 4), attachment_size=100 * 1024,
+                repeat=50) :
+    ''' This measures how long <Message.make> (along with turning the message
+        into a string) takes, for each combination of body size, number of
+        recipients, and number of attachments. Attachments are taken from the
+        cache after the first call, as they are when sending many
+        messages. '''
+
+    directory = tempfile.mkdtemp(prefix='email_lib-bench-')
+    try :
+        paths = [_write_file(directory, attachment_size,
+                             'attachment-%d' % index)
+                 for index in xrange(max(attachment_counts))]
+
+        results = []
+        for body_size in body_sizes :
+            for recipients in recipient_counts :
+                for attachment_count in attachment_counts :
+                    results.append(_isolated(
+                        '_make_case', paths=paths[:attachment_count],
+                        body_size=body_size, recipients=recipients,
+                        attachment_size=attachment_size, repeat=repeat))
+    finally :
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+def _make_case (paths, body_size, recipients, attachment_size, repeat) :
+    attachments = [lib.Attachment(path, 'binary') for path in paths]
+    message     = _make_message(body_size, recipients, attachments)
+
+    def make () :
+        message.invalidate()
+        str(message)
+
+    timings = _timed(make, repeat)
+    size    = len(str(message))
+
+    parameters = {'body_size'       : body_size,
+                  'recipients'      : recipients,
+                  'attachments'     : len(paths),
+                  'attachment_size' : attachment_size,
+                  'repeat'          : repeat}
+
+    return _result('make', parameters, message_size=size,
+                   median=_percentile(timings, 0.5),
+                   p95=_percentile(timings, 0.95), best=timings[0])
+
+def bench_attachment (sizes=(64 * 1024, 1024 * 1024, 16 * 1024 * 1024),
+                      read_modes=('binary', 'plain'), repeat=5) :
+    ''' This measures how fast <Attachment.make> reads and encodes files of
+        each size, with the attachment cache turned off. '''
+
+    directory = tempfile.mkdtemp(prefix='email_lib-bench-')
+    try :
+        results = []
+        for size in sizes :
+            for read_mode in read_modes :
+                path = _write_file(directory, size,
+                                   is_text=read_mode == 'plain')
+
+                results.append(_isolated('_attachment_case', path=path,
+                                         size=size, read_mode=read_mode,
+                                         repeat=repeat))
+    finally :
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+def _attachment_case (path, size, read_mode, repeat) :
+    cache     = lib.Attachment.cache
+    max_bytes = cache.max_bytes
+    try :
+        cache.set_max_bytes(0)
+
+        attachment = lib.Attachment(path, read_mode)
+
+        timings = _timed(attachment.make, repeat)
+        median  = _percentile(timings, 0.5)
+    finally :
+        cache.set_max_bytes(max_bytes)
+
+    parameters = {'size'      : size,
+                  'read_mode' : read_mode,
+                  'repeat'    : repeat}
+
+    return _result('attachment', parameters, median=median, best=timings[0],
+                   megabytes_per_second=size / median / 1e6)
+
+def _send_all (server, messages, workers) :
+    ''' This sends <messages> from <workers> threads, one message per call
+        to <server.send>, and returns how long each took (sorted), along
+        with the number which failed. '''
+
+    messages = iter(messages)
+    timings  = []
+    failed   = [0]
+    lock     = threading.Lock()
+
+    def work () :
+        while True :
+            with lock :
+                message = next(messages, None)
+
+            if message is None :
+                return
+
+            start = time.time()
+            try :
+                server.send(message)
+            except Exception :
+                with lock :
+                    failed[0] += 1
+            else :
+                with lock :
+                    timings.append(time.time() - start)
+
+    threads = [threading.Thread(target=work) for _ in xrange(workers)]
+    for thread in threads :
+        thread.start()
+
+    for thread in threads :
+        thread.join()
+
+    timings.sort()
+    return timings, failed[0]
+
+def bench_send (count=500, body_sizes=(1024, 100 * 1024),
+                recipient_counts=(1, 10), worker_counts=(1, 4),
+                tls='starttls', latency=0.0, fail_rate=0.0, max_idle=60.0) :
+    ''' This measures sending through an <EmailServer> to a local
+        <SMTPSink>, end to end: messages per second, the latency of each
+        message (including waiting for a connection), and peak memory.
+        <tls> is used by both (see <EmailServer>), and <max_idle> is the
+        server's, so a small one measures connecting as well. '''
+
+    results = []
+    for body_size in body_sizes :
+        for recipients in recipient_counts :
+            for workers in worker_counts :
+                results.append(_isolated(
+                    '_send_case', count=count, body_size=body_size,
+                    recipients=recipients, workers=workers, tls=tls,
+                    latency=latency, fail_rate=fail_rate,
+                    max_idle=max_idle))
+
+    return results
+
+def _send_case (count, body_size, recipients, workers, tls, latency,
+                fail_rate, max_idle) :
+    with SMTPSink(tls=tls, latency=latency, fail_rate=fail_rate,
+                  seed=0) as smtp_sink :
+        server   = email_lib.EmailServer('127.0.0.1', smtp_sink.port,
+                                         'user', 'password',
+                                         pool_size=workers,
+                                         max_idle=max_idle, tls=tls)
+        messages = (_make_message(body_size, recipients)
+                    for _ in xrange(count))
+
+        gc.collect()
+
+        start           = time.time()
+        timings, failed = _send_all(server, messages, workers)
+        elapsed         = time.time() - start
+
+        server.close()
+
+    parameters = {'count'      : count,
+                  'body_size'  : body_size,
+                  'recipients' : recipients,
+                  'workers'    : workers,
+                  'tls'        : tls,
+                  'latency'    : latency,
+                  'fail_rate'  : fail_rate,
+                  'max_idle'   : max_idle}
+
+    return _result('send', parameters,
+                   messages_per_second=(count - failed) / elapsed,
+                   failed=failed,
+                   connections=smtp_sink.stats['connections'],
+                   p50=_percentile(timings, 0.5),
+                   p90=_percentile(timings, 0.9),
+                   p99=_percentile(timings, 0.99),
+                   max=_percentile(timings, 1.0))
+
+def run (benchmarks=('import', 'make', 'attachment', 'send'), quick=False,
+         **send_options) :
+    ''' This runs the benchmarks named, and returns a report (a dict) which
+        can be saved and compared with later runs. With <quick> fewer
+        repetitions, and smaller inputs, are used. <send_options> are passed
+        on to <bench_send>. '''
+
+    results = []
+    if 'import' in benchmarks :
+        results += bench_import(repeat=3 if quick else 10)
+
+    if 'make' in benchmarks :
+        if quick :
+            results += bench_make(recipient_counts=(1,),
+                                  attachment_counts=(0, 1), repeat=10)
+        else :
+            results += bench_make()
+
+    if 'attachment' in benchmarks :
+        if quick :
+            results += bench_attachment(sizes=(1024 * 1024,), repeat=3)
+        else :
+            results += bench_attachment()
+
+    if 'send' in benchmarks :
+        if quick :
+            send_options.setdefault('count', 100)
+            send_options.setdefault('body_sizes', (1024,))
+
+        results += bench_send(**send_options)
+
+    return {'version'  : email_lib.__version__,
+            'python'   : platform.python_version(),
+            'platform' : platform.platform(),
+            'time'     : time.time(),
+            'results'  : results}
+
+''' For each benchmark, the metrics compared between runs, and whether bigger
+    is better for each. '''
+_COMPARED = {'import'     : (('median', False),),
+             'make'       : (('median', False),),
+             'attachment' : (('megabytes_per_second', True),),
+             'send'       : (('messages_per_second', True), ('p99', False))}
+
+def _key (result) :
+    return result['benchmark'], tuple(sorted(result['parameters'].items()))
+
+def compare (old, new) :
+    ''' This compares two reports made by <run>, and returns a list of
+        <(benchmark, parameters, metric, old value, new value, change)>
+        tuples, where <change> is the relative change (positive is better).
+        Only results found in both reports are compared. '''
+
+    old_results = dict((_key(result), result) for result in old['results'])
+
+    changes = []
+    for result in new['results'] :
+        old_result = old_results.get(_key(result))
+        if old_result is None :
+            continue
+
+        for metric, is_bigger_better in _COMPARED.get(result['benchmark'],
+                                                      ()) :
+            old_value = old_result['metrics'].get(metric)
+            new_value = result['metrics'].get(metric)
+            if not old_value or new_value is None :
+                continue
+
+            change = (new_value - old_value) / float(old_value)
+            if not is_bigger_better :
+                change = -change
+
+            changes.append((result['benchmark'], result['parameters'],
+                            metric, old_value, new_value, change))
+
+    return changes
+
+def regressions (changes, tolerance=0.1) :
+    ''' The changes (from <compare>) which are worse than <tolerance>. '''
+
+    return [change for change in changes if change[-1] < -tolerance]
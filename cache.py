@@ -0,0 +1,110 @@
+''' This module contains the process-wide cache of made (read and encoded)
+    attachments, so that a file which is attached to many messages is only
+    read and encoded once. '''
+
+
+import threading
+import collections
+
+__all__ = ['AttachmentCache', 'attachment_cache']
+
+''' The default byte budget of the process-wide cache. '''
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+class AttachmentCache (object) :
+    ''' A least recently used cache of made attachment objects, which is
+        limited by the total size of their payloads.
+
+        <max_bytes> : The total payload size which may be cached. When this
+                      is exceeded, the least recently used entries are
+                      evicted. <0> disables the cache. '''
+
+    def __init__ (self, max_bytes=DEFAULT_MAX_BYTES) :
+        self._entries = collections.OrderedDict()
+        self._lock    = threading.Lock()
+        self._size    = 0
+
+        self.max_bytes = max_bytes
+
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def __len__ (self) :
+        return len(self._entries)
+
+    def __contains__ (self, key) :
+        return key in self._entries
+
+    def _evict (self) :
+        while self._entries and self._size > self.max_bytes :
+            _, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+
+    def size (self) :
+        ''' The total payload size currently cached, in bytes. '''
+
+        return self._size
+
+    def set_max_bytes (self, max_bytes) :
+        ''' This changes the byte budget, evicting entries if necessary. '''
+
+        with self._lock :
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get (self, key) :
+        ''' This returns the cached attachment object for <key>, or <None>. '''
+
+        with self._lock :
+            try :
+                entry = self._entries.pop(key)
+            except KeyError :
+                self.misses += 1
+                return None
+            else :
+                # Re-inserting the entry marks it as the most recently used.
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[0]
+
+    def put (self, key, attachment, size) :
+        ''' This caches <attachment>, whose payload is <size> bytes long. An
+            attachment larger than the whole budget isn't cached. '''
+
+        if size > self.max_bytes :
+            return
+
+        with self._lock :
+            old = self._entries.pop(key, None)
+            if old is not None :
+                self._size -= old[1]
+
+            self._entries[key] = (attachment, size)
+            self._size += size
+            self._evict()
+
+    def clear (self) :
+        ''' This empties the cache, and resets the counters. '''
+
+        with self._lock :
+            self._entries.clear()
+            self._size = 0
+
+            self.hits      = 0
+            self.misses    = 0
+            self.evictions = 0
+
+    def stats (self) :
+        ''' This returns a dict of the cache's counters. '''
+
+        return {'hits'      : self.hits,
+                'misses'    : self.misses,
+                'evictions' : self.evictions,
+                'entries'   : len(self._entries),
+                'bytes'     : self._size,
+                'max_bytes' : self.max_bytes}
+
+''' The cache shared by every <Attachment> object. '''
+attachment_cache = AttachmentCache()
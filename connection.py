@@ -0,0 +1,126 @@
+''' This module contains the <smtplib.SMTP> subclasses which <EmailServer>
+    connects with. <smtplib> builds a new SSL context for every socket it
+    wraps, and works out the name it gives in EHLO for every connection
+    (which can mean a DNS lookup). These classes share one SSL context
+    between connections, and work out the EHLO name once. '''
+
+
+import ssl
+import socket
+import smtplib
+import threading
+
+__all__ = ['TLS_MODES', 'default_context', 'local_hostname', 'connect']
+
+''' <'starttls'> connects in plain text and then upgrades the connection with
+    STARTTLS, <'implicit'> uses TLS from the start (SMTPS, usually on port
+    465), and <None> never uses TLS. '''
+TLS_MODES = ('starttls', 'implicit', None)
+
+_lock           = threading.Lock()
+_context        = None
+_local_hostname = None
+
+def default_context () :
+    ''' The SSL context used when one isn't given to <EmailServer>. It's made
+        the first time it's needed, and then shared by every connection. Like
+        <smtplib> it doesn't verify the server's certificate, for that give
+        <EmailServer> a context from <ssl.create_default_context> (which is
+        then shared in the same way, so its certificates are only loaded
+        once). '''
+
+    global _context
+
+    with _lock :
+        if _context is None :
+            context          = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+            _context         = context
+
+        return _context
+
+def local_hostname () :
+    ''' The name given in EHLO, which is worked out the same way <smtplib>
+        does, but only once. '''
+
+    global _local_hostname
+
+    if _local_hostname is None :
+        fqdn = socket.getfqdn()
+        if '.' in fqdn :
+            _local_hostname = fqdn
+        else :
+            address = '127.0.0.1'
+            try :
+                address = socket.gethostbyname(socket.gethostname())
+            except socket.gaierror :
+                pass
+
+            _local_hostname = '[%s]' % address
+
+    return _local_hostname
+
+class _SMTP (smtplib.SMTP) :
+    ''' An <smtplib.SMTP> object which wraps its socket with <context>. '''
+
+    def __init__ (self, host, port, context, timeout) :
+        self._context     = context
+        self._server_name = host
+        smtplib.SMTP.__init__(self, host, port, local_hostname(), timeout)
+
+    def _wrap (self, sock) :
+        if ssl.HAS_SNI :
+            return self._context.wrap_socket(
+                       sock, server_hostname=self._server_name)
+
+        return self._context.wrap_socket(sock)
+
+    def starttls (self) :
+        ''' This is <smtplib.SMTP.starttls>, with the shared context. '''
+
+        self.ehlo_or_helo_if_needed()
+        if not self.has_extn('starttls') :
+            raise smtplib.SMTPException('STARTTLS extension not supported by '
+                                        'server.')
+
+        code, reply = self.docmd('STARTTLS')
+        if code != 220 :
+            raise smtplib.SMTPResponseException(code, reply)
+
+        self.sock = self._wrap(self.sock)
+        self.file = smtplib.SSLFakeFile(self.sock)
+
+        # Anything learned before TLS has to be forgotten (RFC 3207).
+        self.helo_resp      = None
+        self.ehlo_resp      = None
+        self.esmtp_features = {}
+        self.does_esmtp     = 0
+
+        return code, reply
+
+class _SMTPImplicit (_SMTP) :
+    ''' An <smtplib.SMTP> object which uses TLS from the start, like
+        <smtplib.SMTP_SSL>, with the shared context. '''
+
+    def _get_socket (self, host, port, timeout) :
+        sock      = socket.create_connection((host, port), timeout)
+        sock      = self._wrap(sock)
+        self.file = smtplib.SSLFakeFile(sock)
+
+        return sock
+
+def connect (host, port, tls='starttls', context=None, timeout=None) :
+    ''' This connects to the server at <host> and <port>, and returns the
+        <smtplib.SMTP> object. With <'implicit'> TLS the handshake is done
+        here, with <'starttls'> it's left to the object's <starttls> method.
+        <context> is the SSL context used, <default_context()> by default.
+        <timeout> is the number of seconds the socket waits on the server,
+        <None> means it waits forever. '''
+
+    if context is None :
+        context = default_context()
+
+    if tls == 'implicit' :
+        return _SMTPImplicit(host, port, context, timeout)
+
+    return _SMTP(host, port, context, timeout)
@@ -3,7 +3,8 @@
 
 __all__ = ['ASCII', 'ISO', 'UTF', 'ENCODINGS', 'MIME_TYPE_TEXT',
            'MIME_TYPE_PNG_IMAGE', 'MIME_TYPE_JPG_IMAGE',
-           'MIME_TYPE_APPLICATION', 'MIME_TYPES']
+           'MIME_TYPE_APPLICATION', 'MIME_TYPES', 'STREAM_CHUNK_SIZE',
+           'STREAM_THRESHOLD', 'MAX_RECIPIENTS', 'TIMEOUT']
 
 ''' Some common encoding scheme names. '''
 ASCII = 'us-ascii'
@@ -22,3 +23,18 @@ MIME_TYPE_APPLICATION = 'application/octet-stream'
 MIME_TYPES = [MIME_TYPE_TEXT, MIME_TYPE_PNG_IMAGE, MIME_TYPE_JPG_IMAGE,
               MIME_TYPE_APPLICATION]
 
+
+''' Streamed attachments are read in chunks of about this many bytes (a
+    multiple of 57, so each chunk base64 encodes to whole lines). '''
+STREAM_CHUNK_SIZE = 57 * 1024 * 16
+
+''' Messages with at least this many bytes of attachments are streamed. '''
+STREAM_THRESHOLD = 8 * 1024 * 1024
+
+''' The most recipients given to the server in one transaction (RFC 5321
+    requires servers to accept at least this many). '''
+MAX_RECIPIENTS = 100
+
+''' The number of seconds a connection waits on the server (to connect, or
+    for a reply) before giving up on it. '''
+TIMEOUT = 60.0
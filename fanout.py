@@ -0,0 +1,190 @@
+''' This module contains the fan-out class, which sends the same content to
+    many recipients as separate messages (each with its own <To> header).
+    The body and attachments are made, and quoted for DATA, only once, and
+    just the small header block is made for each message, so the cost of a
+    message doesn't grow with the size of its body and attachments. '''
+
+
+import threading
+import email.Header
+import email.Utils
+
+import email_lib.lib as lib
+import email_lib.transport as transport
+
+__all__ = ['FanOut']
+
+def _format_header (name, value) :
+    ''' This formats a header just as <email.Generator> does. '''
+
+    try :
+        value.decode('us-ascii')
+    except UnicodeError :
+        # Like the generator, 8-bit values are written as they are.
+        pass
+    else :
+        value = email.Header.Header(value, maxlinelen=78,
+                                    header_name=name).encode()
+
+    return '%s: %s\n' % (name, value)
+
+def _split_headers (head) :
+    ''' This splits a header block into a list of <[name, text]> entries,
+        where <text> includes any continuation lines. '''
+
+    entries = []
+    for line in head.splitlines(True) :
+        if line[:1] in (' ', '\t') and entries :
+            entries[-1][1] += line
+        else :
+            entries.append([line.split(':', 1)[0].lower(), line])
+
+    return entries
+
+class _SharedBody (object) :
+    ''' The part of a fanned out message which every message has in common :
+        the headers (apart from <To> and <Date>), and the body following them,
+        both as it's made and as it's written after DATA. '''
+
+    def __init__ (self, literal) :
+        end = literal.index('\n\n') + 1
+
+        self.headers = _split_headers(literal[:end])
+        self.body    = literal[end + 1:]
+        self.quoted  = transport.quote(self.body)
+
+class _FanOutMessage (lib.Message) :
+    ''' One of the messages made by a <FanOut>. Only its header block is its
+        own, the rest is shared with the other messages. '''
+
+    def __init__ (self, fan_out, to) :
+        lib.Message.__init__(self, fan_out.from_, to, fan_out.subject,
+                             fan_out.body, fan_out.attachments)
+
+        self._fan_out = fan_out
+        self._heads   = {}
+
+    def __getstate__ (self) :
+        state = lib.Message.__getstate__(self)
+        state['_heads'] = {}
+
+        return state
+
+    def _head (self, eight_bit) :
+        ''' This returns the <(head, quoted)> tuple of the message's header
+            block (including the blank line after it), which is made again
+            once <to>, or the shared content, changes. '''
+
+        to     = self._freeze(self.to)
+        shared = self._fan_out._shared(eight_bit)
+        entry  = self._heads.get(eight_bit)
+        if entry is None or entry[0] != to or entry[1] is not shared :
+            own = {'to'   : str(self._recipients_for(self.to)),
+                   'date' : email.Utils.formatdate(localtime=True)}
+
+            head = []
+            for name, text in shared.headers :
+                if name in own :
+                    text = _format_header(text.split(':', 1)[0], own[name])
+
+                head.append(text)
+
+            head.append('\n')
+            head = ''.join(head)
+
+            entry = self._heads[eight_bit] = (
+                        to, shared, head,
+                        ''.join(transport.quote_chunks([head])))
+
+        return entry[2:]
+
+    def _as_string (self, eight_bit=False) :
+        head = self._head(eight_bit)[0]
+        return head + self._fan_out._shared(eight_bit).body
+
+    def _quoted_parts (self, eight_bit=False) :
+        ''' This returns the message as it's written after DATA, as a list of
+            strings : its own header block, and the shared body (which isn't
+            copied). '''
+
+        return [self._head(eight_bit)[1],
+                self._fan_out._shared(eight_bit).quoted]
+
+    def invalidate (self) :
+        lib.Message.invalidate(self)
+        self._heads = {}
+
+class FanOut (object) :
+    ''' This class makes a separate <Message> object for each of many
+        recipients, which all have the same content. The content is made only
+        once (for each kind of server, see <Attachment.make>), and each
+        message makes just its own <To> and <Date> headers, so sending to
+        many recipients costs little more than the header blocks.
+
+        <from_>       : The "from" address.
+        <subject>     : The message's subject text.
+        <body>        : The text that comprises the message's body.
+        <attachments> : A single <Attachment> object, or a list of them.
+
+        The content is made the first time it's needed, <remake> has to be
+        called after it's changed. '''
+
+    def __init__ (self, from_, subject=u'', body=u'', attachments=()) :
+        self.from_       = from_
+        self.subject     = subject
+        self.body        = body
+        self.attachments = attachments
+
+        self._lock   = threading.Lock()
+        self._bodies = {}
+
+    def __getstate__ (self) :
+        ''' The made content isn't pickled, it's made again when needed. '''
+
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_bodies'] = {}
+
+        return state
+
+    def __setstate__ (self, state) :
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _shared (self, eight_bit) :
+        ''' This returns the <_SharedBody> made for a server which does (or
+            doesn't) support 8BITMIME. Messages are sent from many threads,
+            but it's only made once. '''
+
+        shared = self._bodies.get(eight_bit)
+        if shared is None :
+            with self._lock :
+                shared = self._bodies.get(eight_bit)
+                if shared is None :
+                    template = lib.Message(self.from_, (), self.subject,
+                                           self.body, self.attachments)
+                    shared   = _SharedBody(template._as_string(eight_bit))
+
+                    self._bodies[eight_bit] = shared
+
+        return shared
+
+    def remake (self) :
+        ''' This throws away the made content, so it's made again. This is
+            needed after the fan-out's attributes have been changed. '''
+
+        with self._lock :
+            self._bodies = {}
+
+    def render (self, to) :
+        ''' This returns a <Message> object sent to <to> (an address, or a
+            list of addresses). '''
+
+        return _FanOutMessage(self, to)
+
+    def messages (self, recipients) :
+        ''' This lazily yields a <Message> object for every recipient in the
+            iterable <recipients>. '''
+
+        for to in recipients :
+            yield self.render(to)
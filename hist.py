@@ -0,0 +1,286 @@
+''' This module contains the storage back ends for the history of sent
+    messages (<EmailServer.hist>). A store is given the information about
+    each message sent, and can look past messages up by recipient and by
+    time (in seconds since the epoch). '''
+
+
+import time
+import bisect
+import collections
+
+__all__ = ['HistRecord', 'ListStore', 'RingStore', 'SQLiteStore']
+
+''' A compact record of a sent message, which leaves out the <Message> object
+    and its string form. <size> is the length of the string form, or <None>
+    if it was streamed. <errors> maps refused recipients to the server's
+    <(code, response)> reply. '''
+HistRecord = collections.namedtuple('HistRecord', ['time', 'from_', 'to',
+                                                   'subject', 'size',
+                                                   'errors'])
+
+def _make_record (info, when) :
+    message, from_, to, literal, errors = info[:5]
+
+    subject = getattr(message, 'subject', None)
+    if subject is not None :
+        subject = unicode(subject)
+
+    if literal is None :
+        size = None
+    else :
+        size = len(literal)
+
+    return HistRecord(when, unicode(from_), tuple(to), subject, size,
+                      dict(errors))
+
+def _in_range (when, since, until) :
+    return ((since is None or when >= since) and
+            (until is None or when < until))
+
+class ListStore (object) :
+    ''' This keeps everything about every message sent in a list, i.e.,
+        <(message, from_, to, literal, errors, date_time)> tuples. Nothing is
+        ever dropped, so this is best suited to short lived programs. '''
+
+    def __init__ (self) :
+        self._past         = []
+        self._times        = []
+        self._by_recipient = {}
+
+    def __iter__ (self) :
+        return iter(self._past)
+
+    def __len__ (self) :
+        return len(self._past)
+
+    def __getitem__ (self, index) :
+        return self._past[index]
+
+    def add (self, info) :
+        index = len(self._past)
+
+        self._past.append(info)
+        self._times.append(time.time())
+
+        for recipient in info[2] :
+            self._by_recipient.setdefault(recipient, []).append(index)
+
+    def find (self, recipient=None, since=None, until=None) :
+        if recipient is not None :
+            indexes = [index for index in self._by_recipient.get(recipient, ())
+                       if _in_range(self._times[index], since, until)]
+        else :
+            start = 0
+            if since is not None :
+                start = bisect.bisect_left(self._times, since)
+
+            end = len(self._times)
+            if until is not None :
+                end = bisect.bisect_left(self._times, until)
+
+            indexes = xrange(start, end)
+
+        return [self._past[index] for index in indexes]
+
+    def clear (self) :
+        del self._past[:]
+        del self._times[:]
+        self._by_recipient.clear()
+
+class RingStore (object) :
+    ''' This keeps a <HistRecord> for each of the last <max_entries> messages
+        sent. Older records are dropped as new ones are added, so memory use
+        is bounded. '''
+
+    def __init__ (self, max_entries=1000) :
+        self.max_entries = max_entries
+
+        self._records      = collections.deque()
+        self._by_recipient = {}
+
+    def __iter__ (self) :
+        return iter(self._records)
+
+    def __len__ (self) :
+        return len(self._records)
+
+    def __getitem__ (self, index) :
+        return self._records[index]
+
+    def _drop_oldest (self) :
+        record = self._records.popleft()
+
+        # Records are dropped in the order they were added, so this record is
+        # first in each of its recipients' queues.
+        for recipient in record.to :
+            queue = self._by_recipient[recipient]
+            queue.popleft()
+            if not queue :
+                del self._by_recipient[recipient]
+
+    def add (self, info) :
+        if self.max_entries <= 0 :
+            return
+
+        record = _make_record(info, time.time())
+        while len(self._records) >= self.max_entries :
+            self._drop_oldest()
+
+        self._records.append(record)
+        for recipient in record.to :
+            queue = self._by_recipient.setdefault(recipient,
+                                                  collections.deque())
+            queue.append(record)
+
+    def find (self, recipient=None, since=None, until=None) :
+        if recipient is not None :
+            records = self._by_recipient.get(recipient, ())
+            return [record for record in records
+                    if _in_range(record.time, since, until)]
+
+        # Only the records newer than <since> are looked at, starting from
+        # the newest.
+        found = []
+        for record in reversed(self._records) :
+            if since is not None and record.time < since :
+                break
+
+            if until is None or record.time < until :
+                found.append(record)
+
+        found.reverse()
+        return found
+
+    def clear (self) :
+        self._records.clear()
+        self._by_recipient.clear()
+
+class SQLiteStore (object) :
+    ''' This appends a <HistRecord> for each message sent to an SQLite
+        database, which is indexed by recipient and by time. Nothing is kept
+        in memory.
+
+        <path> : The database's file name. '''
+
+    _schema = ('CREATE TABLE IF NOT EXISTS hist ('
+               '    id      INTEGER PRIMARY KEY,'
+               '    time    REAL,'
+               '    from_   TEXT,'
+               '    subject TEXT,'
+               '    size    INTEGER,'
+               '    errors  TEXT)',
+
+               'CREATE TABLE IF NOT EXISTS hist_to ('
+               '    hist_id INTEGER,'
+               '    address TEXT,'
+               '    time    REAL)',
+
+               'CREATE INDEX IF NOT EXISTS hist_time ON hist (time)',
+
+               'CREATE INDEX IF NOT EXISTS hist_to_address '
+               'ON hist_to (address, time)',
+
+               'CREATE INDEX IF NOT EXISTS hist_to_hist_id '
+               'ON hist_to (hist_id)')
+
+    def __init__ (self, path) :
+        # This is only imported when it's needed.
+        import sqlite3
+
+        self.path = path
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self._connection :
+            for statement in self._schema :
+                self._connection.execute(statement)
+
+    def __iter__ (self) :
+        rows = self._connection.execute('SELECT * FROM hist ORDER BY id')
+        for row in rows :
+            yield self._to_record(row)
+
+    def __len__ (self) :
+        cursor = self._connection.execute('SELECT COUNT(*) FROM hist')
+        return cursor.fetchone()[0]
+
+    def __getitem__ (self, index) :
+        if index < 0 :
+            index += len(self)
+
+        cursor = self._connection.execute('SELECT * FROM hist ORDER BY id '
+                                          'LIMIT 1 OFFSET ?', (index,))
+        row = cursor.fetchone()
+        if row is None :
+            raise IndexError('History index out of range.')
+
+        return self._to_record(row)
+
+    def _to_record (self, row) :
+        import json
+
+        id_, when, from_, subject, size, errors = row
+
+        to = self._connection.execute('SELECT address FROM hist_to '
+                                      'WHERE hist_id = ? ORDER BY rowid',
+                                      (id_,))
+
+        errors = dict((address, tuple(error))
+                      for address, error in json.loads(errors).iteritems())
+
+        return HistRecord(when, from_, tuple(address for (address,) in to),
+                          subject, size, errors)
+
+    def add (self, info) :
+        import json
+
+        record = _make_record(info, time.time())
+
+        with self._connection :
+            cursor = self._connection.execute(
+                         'INSERT INTO hist (time, from_, subject, size, '
+                         'errors) VALUES (?, ?, ?, ?, ?)',
+                         (record.time, record.from_, record.subject,
+                          record.size, json.dumps(record.errors)))
+
+            self._connection.executemany(
+                'INSERT INTO hist_to (hist_id, address, time) '
+                'VALUES (?, ?, ?)',
+                [(cursor.lastrowid, address, record.time)
+                 for address in record.to])
+
+    def find (self, recipient=None, since=None, until=None) :
+        conditions = []
+        parameters = []
+
+        if since is not None :
+            conditions.append('time >= ?')
+            parameters.append(since)
+
+        if until is not None :
+            conditions.append('time < ?')
+            parameters.append(until)
+
+        if recipient is not None :
+            conditions.append('address = ?')
+            parameters.append(recipient)
+
+            query = ('SELECT * FROM hist WHERE id IN '
+                     '(SELECT hist_id FROM hist_to WHERE %s) ORDER BY id')
+        else :
+            query = 'SELECT * FROM hist WHERE %s ORDER BY id'
+
+        query %= ' AND '.join(conditions) or '1'
+
+        rows = self._connection.execute(query, parameters).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def clear (self) :
+        with self._connection :
+            self._connection.execute('DELETE FROM hist_to')
+            self._connection.execute('DELETE FROM hist')
+
+    def close (self) :
+        self._connection.close()
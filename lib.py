@@ -3,15 +3,40 @@
 
 
 import os
+import sys
+import time
+import base64
+import random
 import socket
 import smtplib
 import email
-import mimetypes
+import threading
+import collections
+import Queue
 
 import email_lib.constants as constants
+import email_lib.mime_types as mime_types
 import email_lib.iso_time as iso_time
+import email_lib.pool as pool
+import email_lib.cache as cache
+import email_lib.transport as transport
+import email_lib.connection as connection
+import email_lib.transfer_encoding as transfer_encoding
+import email_lib.hist as hist
+from email_lib.metrics import NULL_METRICS
 
-__all__ = ['Attachment', 'Message', 'EmailServer']
+__all__ = ['Attachment', 'Message', 'SendResult', 'EmailServer']
+
+''' The default charsets, in order, which <Message._encoding> can choose from
+    without trying each one. '''
+_ENCODINGS = [constants.ASCII, constants.ISO, constants.UTF]
+
+def _make_boundary () :
+    ''' This makes a MIME boundary in the same style as <email.Generator>.
+        Streamed content can't be searched for the boundary beforehand, but a
+        random 19 digit number won't turn up by chance. '''
+
+    return '=' * 15 + '%019d' % random.randrange(sys.maxint) + '=='
 
 class Attachment (object) :
     ''' This is the email attachment class, arbitrary files can be attached to
@@ -24,10 +49,16 @@ class Attachment (object) :
         <type_>        : A MIME content-type string. (A type is guessed if
                          nothing is given)
         <default_type> : The MIME content-type used if none are given, and none
-                         can be guessed. '''
+                         can be guessed.
+
+        Made attachments are kept in <self.cache> (which is shared by every
+        attachment by default), keyed by the path, the options above, and the
+        file's size and modification time. '''
 
     _is_attachment = True
 
+    cache = cache.attachment_cache
+
     def __init__ (self, path, read_mode='plain', type_=None,
                   default_type=constants.MIME_TYPE_TEXT) :
         self.path         = path
@@ -41,18 +72,27 @@ class Attachment (object) :
     def __unicode__ (self) :
         return unicode(self.make().as_string())
 
-    def _read (self, attachment, path) :
+    def _read (self, attachment, path, eight_bit) :
         with open(path, 'r') as attachment_file :
             file_content = attachment_file.read()
             attachment.set_payload(file_content)
             return file_content
 
-    def _read_binary (self, attachment, path) :
+    def _read_binary (self, attachment, path, eight_bit) :
+        ''' Text is sent in whichever transfer encoding is smallest, other
+            types are always base64 encoded, since their line endings have
+            to be kept as they are. '''
+
         with open(path, 'rb') as attachment_file :
             file_content = attachment_file.read()
-            attachment.set_payload(file_content)
-            email.Encoders.encode_base64(attachment)
-            return file_content
+
+        if attachment.get_content_maintype() == 'text' :
+            transfer = transfer_encoding.choose(file_content, eight_bit)
+        else :
+            transfer = transfer_encoding.BASE64
+
+        transfer_encoding.encode(attachment, file_content, transfer)
+        return file_content
 
     _read_modes = {'plain' : _read,
                    'p'     : _read,
@@ -63,9 +103,62 @@ class Attachment (object) :
                    'b'      : _read_binary,
                    'rb'     : _read_binary}
 
+    def _stream (self, attachment_file, chunk_size) :
+        ''' Plain files are copied a line at a time, and lines starting with
+            "From " are escaped just as <email.Generator> escapes them. '''
+
+        lines = []
+        size  = 0
+        for line in attachment_file :
+            if line.startswith('From ') :
+                line = '>' + line
+
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_size :
+                yield ''.join(lines)
+                lines = []
+                size  = 0
+
+        if lines :
+            yield ''.join(lines)
+
+    def _stream_text (self, attachment_file, chunk_size, transfer) :
+        return transfer_encoding.encode_chunks(attachment_file, transfer,
+                                               chunk_size)
+
+    def _stream_binary (self, attachment_file, chunk_size) :
+        ''' Binary files are read in blocks whose size is a multiple of 57
+            bytes, so each block encodes to whole base64 lines, exactly as
+            <email.Encoders.encode_base64> encodes the whole file. '''
+
+        block_size = max(1, chunk_size // 57) * 57
+
+        block = attachment_file.read(block_size)
+        while block :
+            next_block = attachment_file.read(block_size)
+
+            encoded = base64.encodestring(block)
+            if not next_block and not block.endswith('\n') :
+                # <email.Encoders> drops base64's trailing newline.
+                encoded = encoded[:-1]
+
+            yield encoded
+
+            block = next_block
+
+    _streams = {_read        : _stream,
+                _read_binary : _stream_binary}
+
+    def _read_func (self, read_mode) :
+        try :
+            return self._read_modes[str(read_mode).lower()]
+        except KeyError :
+            raise KeyError("The read mode must be <'plain'> or <'binary'>.")
+
     def _handle_mime_content_type (self, path, content_type, default_type) :
         if content_type is None :
-            guessed_type = mimetypes.guess_type(path)[0]
+            guessed_type = mime_types.guess_type(path)[0]
 
             if guessed_type is not None :
                 if guessed_type != 'image/x-png' :
@@ -83,26 +176,38 @@ class Attachment (object) :
         else :
             return type_, subtype
 
-    def _make (self, path, read_mode, content_type, default_type, basename) :
+    def _make (self, path, read_mode, content_type, default_type, basename,
+               eight_bit=False) :
         type_, subtype = self._handle_mime_content_type(path, content_type,
                                                         default_type)
 
         attachment = email.MIMEBase.MIMEBase(type_, subtype)
 
-        try :
-            read_func = self._read_modes[str(read_mode).lower()]
-        except KeyError :
-            raise KeyError("The read mode must be <'plain'> or <'binary'>.")
-        else :
-            read_func(self, attachment, path)
+        read_func = self._read_func(read_mode)
+        read_func(self, attachment, path, eight_bit)
 
-            attachment.add_header('Content-Disposition',
-                                  'attachment; filename=%s' % basename)
+        attachment.add_header('Content-Disposition',
+                              'attachment; filename=%s' % basename)
 
-            # This is only needed once in a multipart message.
-            del attachment['MIME-Version']
+        # This is only needed once in a multipart message.
+        del attachment['MIME-Version']
 
-            return attachment
+        return attachment
+
+    def _state (self) :
+        ''' A snapshot of everything the made attachment depends on, including
+            the file's size and modification time, so a changed file is
+            noticed. '''
+
+        try :
+            stat = os.stat(self.path)
+        except (OSError, TypeError) :
+            file_state = None
+        else :
+            file_state = (stat.st_size, stat.st_mtime)
+
+        return (self.path, self.read_mode, self.type, self.default_type,
+                file_state)
 
     def basename (self) :
         ''' This returns <self.path>'s US-ASCII encoded basename (as outlined
@@ -110,14 +215,112 @@ class Attachment (object) :
 
         return os.path.basename(self.path).encode(constants.ASCII)
 
-    def make (self) :
+    def make (self, eight_bit=False) :
         ''' This makes and returns a MIME attachment object based off of the
-            <email.MIMEBase.MIMEBase> class. '''
+            <email.MIMEBase.MIMEBase> class. Text read in binary mode may be
+            given an 8bit transfer encoding if <eight_bit> is true, i.e., the
+            server supports 8BITMIME.
+
+            Note : The returned object may be cached, so it should be copied
+                   before it's changed. '''
+
+        state = self._state()
+        if self.cache is None or state[-1] is None :
+            # Without a size and modification time a changed file can't be
+            # detected, so there's nothing safe to cache.
+            return self._make(self.path, self.read_mode, self.type,
+                              self.default_type, self.basename(), eight_bit)
+
+        key        = state + (eight_bit,)
+        attachment = self.cache.get(key)
+        if attachment is None :
+            attachment = self._make(self.path, self.read_mode, self.type,
+                                    self.default_type, self.basename(),
+                                    eight_bit)
+            self.cache.put(key, attachment, len(attachment.get_payload()))
 
-        attachment = self._make(self.path, self.read_mode, self.type,
-                                self.default_type, self.basename())
         return attachment
 
+    def size (self) :
+        ''' This returns the size of the attachment's file in bytes, or <0> if
+            it can't be found. '''
+
+        try :
+            return os.path.getsize(self.path)
+        except (OSError, TypeError) :
+            return 0
+
+    def _scan (self, attachment_file, chunk_size) :
+        ''' This reads the file through once, to choose its transfer
+            encoding before any of it is sent, and then rewinds it. '''
+
+        scanner = transfer_encoding.Scanner()
+        for chunk in iter(lambda : attachment_file.read(chunk_size), '') :
+            scanner.update(chunk)
+
+        attachment_file.seek(0)
+
+        return scanner
+
+    def stream (self, chunk_size=constants.STREAM_CHUNK_SIZE,
+                eight_bit=False) :
+        ''' This returns an iterator of the attachment as MIME formatted
+            string chunks, which joined together are the same as <str(self)>
+            (or <self.make> with <eight_bit>). The file is read and encoded a
+            chunk at a time, and it isn't cached.
+
+            The content-type and read mode are checked, and the file is
+            opened, before this returns, so a bad attachment fails before
+            anything has been sent (rather than in the middle of DATA). '''
+
+        type_, subtype = self._handle_mime_content_type(self.path, self.type,
+                                                        self.default_type)
+        read_func = self._read_func(self.read_mode)
+        is_binary = read_func is self._read_modes['binary']
+
+        attachment_file = open(self.path, 'rb' if is_binary else 'r')
+        try :
+            transfer = None
+            if is_binary :
+                if type_ == 'text' :
+                    transfer = self._scan(attachment_file,
+                                          chunk_size).choose(eight_bit)
+                else :
+                    transfer = transfer_encoding.BASE64
+
+            attachment = email.MIMEBase.MIMEBase(type_, subtype)
+            if transfer is not None :
+                attachment['Content-Transfer-Encoding'] = transfer
+
+            attachment.add_header('Content-Disposition',
+                                  'attachment; filename=%s' % self.basename())
+
+            # This is only needed once in a multipart message.
+            del attachment['MIME-Version']
+
+            # Only the headers are written, the payload follows them.
+            attachment.set_payload('')
+            headers = attachment.as_string()
+
+            if transfer in (None, transfer_encoding.BASE64) :
+                chunks = self._streams[read_func](self, attachment_file,
+                                                  chunk_size)
+            else :
+                chunks = self._stream_text(attachment_file, chunk_size,
+                                           transfer)
+        except :
+            attachment_file.close()
+            raise
+
+        return self._chunks(attachment_file, headers, chunks)
+
+    @staticmethod
+    def _chunks (attachment_file, headers, chunks) :
+        with attachment_file :
+            yield headers
+            for chunk in chunks :
+                yield chunk
+
 class _BaseContainer (object) :
     ''' An abstract base class for list based container classes. Inheriting
         classes should have a <_get_container> method, which should return the
@@ -136,10 +339,12 @@ class _BaseContainer (object) :
         return self._get_container()[index]
 
 class _Recipients (_BaseContainer) :
-    ''' This class manages a unique list of recipient email addresses. '''
+    ''' This class manages a unique list of recipient email addresses. The
+        addresses are normalized, and the original order is kept. '''
 
     def __init__ (self, recipients) :
         self._recipients = self._make(recipients)
+        self._unique     = set(self._recipients)
 
         self.delimiter = u', '
 
@@ -149,15 +354,33 @@ class _Recipients (_BaseContainer) :
     def __unicode__ (self) :
         return unicode(self.delimiter).join(self._recipients)
 
+    def __contains__ (self, item) :
+        return self._normalize(item) in self._unique
+
     def _get_container (self) :
         return self._recipients
 
+    @staticmethod
+    def _normalize (recipient) :
+        ''' Surrounding whitespace is removed, and the domain is lower cased
+            (unlike the local part, it isn't case sensitive). '''
+
+        recipient = unicode(recipient).strip()
+
+        local_part, at, domain = recipient.rpartition(u'@')
+        if at :
+            return local_part + at + domain.lower()
+        else :
+            return recipient
+
     def _remove_duplicates (self, recipients) :
         unique_recipients = []
+        seen              = set()
         for recipient in recipients :
-            unicode_recipient = unicode(recipient)
-            if unicode_recipient not in unique_recipients :
-                unique_recipients.append(unicode_recipient)
+            recipient = self._normalize(recipient)
+            if recipient not in seen :
+                seen.add(recipient)
+                unique_recipients.append(recipient)
 
         return unique_recipients
 
@@ -171,6 +394,27 @@ class _Recipients (_BaseContainer) :
 
         return unique_recipients
 
+    def batches (self, size) :
+        ''' This splits the recipients into lists of at most <size> addresses
+            (all of them at once if <size> is <None>). '''
+
+        if size is None or len(self._recipients) <= size :
+            return [list(self._recipients)]
+
+        return [self._recipients[index:index + size]
+                for index in xrange(0, len(self._recipients), size)]
+
+def _recipients_of (message) :
+    ''' This returns a message's <_Recipients>, reusing the ones it already
+        has if it's a <Message> object. '''
+
+    try :
+        recipients_for = message._recipients_for
+    except AttributeError :
+        return _Recipients(message.to)
+    else :
+        return recipients_for(message.to)
+
 class Message (object) :
     ''' This class creates a message object with the proper MIME headers. This
         is just a facade for the <email.MIMEMultipart.MIMEMultipart> class.
@@ -184,10 +428,19 @@ class Message (object) :
         <body>        : The text that comprises the message's body.
         <attachments> : The message's attachments. This can either be a single
                         <Attachment> object, or a list of <Attachment>
-                        objects. '''
+                        objects.
+
+        The made message is cached, and is only made again once one of the
+        above (or an attachment's file) has changed. Its <Date> header is
+        stamped again whenever it's reused, so a message sent more than once
+        is dated when it's sent. Making messages is timed with the <metrics>
+        class attribute, an <email_lib.metrics.Metrics> object shared by
+        every message. '''
 
     _is_message = True
 
+    metrics = NULL_METRICS
+
     def __init__ (self, from_, to, subject=u'', body=u'', attachments=()) :
         self.from_       = from_
         self.to          = to
@@ -195,13 +448,16 @@ class Message (object) :
         self.body        = body
         self.attachments = attachments
 
+        self._rendered   = None
+        self._recipients = None
+
     def __str__ (self) :
         ''' This returns the message as a MIME formatted string.
 
             Note : There is no <Return-Path> header, because it's normally
                    handled by the server. '''
 
-        return self.make().as_string()
+        return self._as_string()
 
     def __unicode__ (self) :
         ''' This returns the message as a MIME formatted unicode string.
@@ -209,15 +465,123 @@ class Message (object) :
             Note : There is no <Return-Path> header, because it's normally
                    handled by the server. '''
 
-        return unicode(self.make().as_string())
+        return unicode(self._as_string())
 
     def __add__ (self, other) :
-        return unicode(self.make().as_string()) + unicode(other)
+        return unicode(self._as_string()) + unicode(other)
 
     def __radd__ (self, other) :
-        return unicode(other) + unicode(self.make().as_string())
+        return unicode(other) + unicode(self._as_string())
+
+    def __getstate__ (self) :
+        ''' The caches aren't pickled, they're filled again when needed. '''
+
+        state = self.__dict__.copy()
+        state['_rendered']   = None
+        state['_recipients'] = None
+
+        return state
+
+    def _freeze (self, value) :
+        ''' Lists (and other containers) are copied into tuples, so changing
+            them in place is noticed as well. '''
+
+        if isinstance(value, basestring) or not hasattr(value, '__iter__') :
+            return value
+        else :
+            return tuple(value)
+
+    def _attachment_state (self, attachment) :
+        try :
+            state = attachment._state
+        except AttributeError :
+            # This isn't an <Attachment>, <_make> raises the error.
+            return attachment
+        else :
+            return state()
+
+    def _state (self) :
+        ''' A snapshot of everything the made message depends on. '''
+
+        attachments = self._freeze(self.attachments)
+        if isinstance(attachments, tuple) :
+            attachments = tuple(self._attachment_state(attachment)
+                                for attachment in attachments)
+        else :
+            attachments = self._attachment_state(attachments)
+
+        return (self.from_, self._freeze(self.to), self.subject, self.body,
+                attachments)
+
+    def _render (self, eight_bit=False) :
+        ''' This returns the <[state, message, string]> cache entry, making the
+            message again if it has changed since it was last made (or was
+            made for a server which differs in supporting 8BITMIME). The
+            string is filled in the first time it's needed. '''
+
+        state    = (self._state(), eight_bit)
+        rendered = self._rendered
+
+        if rendered is None or rendered[0] != state :
+            start    = time.time()
+            message  = self._make(self.from_, self.to, self.body, self.subject,
+                                  self.attachments, eight_bit)
+            rendered = [state, message, None]
+
+            self.metrics.timing('make', time.time() - start)
+
+            self._rendered = rendered
+        else :
+            self._restamp(rendered)
+
+        return rendered
+
+    @staticmethod
+    def _restamp (rendered) :
+        ''' This dates a reused cache entry now. Only the <Date> header of
+            the made message, and of its string, is changed. '''
+
+        message = rendered[1]
+        old     = message['Date']
+        new     = email.Utils.formatdate(localtime=True)
+        if old == new :
+            return
+
+        message.replace_header('Date', new)
+
+        string = rendered[2]
+        if string is not None :
+            # The <Date> header is never the first, and is always in the
+            # header block, which ends at the first blank line.
+            end  = string.index('\n\n') + 1
+            head = string[:end].replace('\nDate: %s\n' % old,
+                                        '\nDate: %s\n' % new, 1)
+
+            rendered[2] = head + string[end:]
+
+    def _as_string (self, eight_bit=False) :
+        rendered = self._render(eight_bit)
+        if rendered[2] is None :
+            start       = time.time()
+            rendered[2] = rendered[1].as_string()
+
+            self.metrics.timing('generate', time.time() - start,
+                                len(rendered[2]))
+
+        return rendered[2]
+
+    @staticmethod
+    def _encoding (text) :
+        if isinstance(text, unicode) and constants.ENCODINGS == _ENCODINGS :
+            # The widest character decides, which takes a single pass.
+            widest = ord(max(text)) if text else 0
+            if widest < 0x80 :
+                return constants.ASCII
+            elif widest < 0x100 :
+                return constants.ISO
+            else :
+                return constants.UTF
 
-    def _encoding (self, text) :
         for encoding in constants.ENCODINGS :
             try :
                 text.encode(encoding)
@@ -228,23 +592,25 @@ class Message (object) :
 
         return encoding
 
-    def _as_mime_text (self, text) :
+    def _as_mime_text (self, text, eight_bit=False) :
+        ''' The transfer encoding is chosen from the encoded text, rather
+            than from its charset (which would always be base64 for UTF-8,
+            say). '''
+
         encoding  = self._encoding(text)
-        mime_text = email.MIMEText.MIMEText(text.encode(encoding),
-                                            _subtype='plain',
-                                            _charset=encoding)
+        data      = text.encode(encoding)
+        mime_text = email.MIMENonMultipart.MIMENonMultipart('text', 'plain',
+                                                            charset=encoding)
+        transfer_encoding.encode(mime_text, data,
+                                 transfer_encoding.choose(data, eight_bit))
 
         # This is only needed once in a multipart message.
         del mime_text['MIME-Version']
 
         return mime_text
 
-    def _make (self, from_, to, body, subject, attachments) :
-        from_   = unicode(from_)
-        to      = _Recipients(to)
-        body    = unicode(body)
-        subject = unicode(subject)
-
+    @staticmethod
+    def _attachment_list (attachments) :
         try :
             attachments.__iter__
         except AttributeError :
@@ -254,6 +620,37 @@ class Message (object) :
         else :
             attachments = list(attachments)
 
+        for attachment in attachments :
+            try :
+                attachment._is_attachment
+                attachment.make
+            except AttributeError :
+                raise AttributeError('Attachments should be instances of the '
+                                     '<Attachment> class.')
+
+        return attachments
+
+    def _recipients_for (self, to) :
+        ''' The unique recipients of <to> are kept until <to> changes, since
+            they're needed both to make the message and to send it. '''
+
+        state = self._freeze(to)
+        if self._recipients is None or self._recipients[0] != state :
+            self._recipients = (state, _Recipients(to))
+
+        return self._recipients[1]
+
+    def _make (self, from_, to, body, subject, attachments,
+               eight_bit=False) :
+        ''' With <eight_bit> (i.e., the server supports 8BITMIME) text may be
+            given an 8bit transfer encoding. '''
+
+        from_       = unicode(from_)
+        to          = self._recipients_for(to)
+        body        = unicode(body)
+        subject     = unicode(subject)
+        attachments = self._attachment_list(attachments)
+
         message = email.MIMEMultipart.MIMEMultipart()
 
         message['From']    = str(from_)
@@ -262,38 +659,205 @@ class Message (object) :
         message['Subject'] = email.Header.Header(unicode(subject),
                                                  constants.ISO)
 
-        message.attach(self._as_mime_text(body))
+        message.attach(self._as_mime_text(body, eight_bit))
 
         for attachment in attachments :
-            try :
-                attachment._is_attachment
-                attachment.make
-            except AttributeError :
-                raise AttributeError('Attachments should be instances of the '
-                                     '<Attachment> class.')
-            else :
-                message.attach(attachment.make())
+            message.attach(attachment.make(eight_bit))
 
         return message
 
     def make (self) :
         ''' This makes and returns a MIME message object based off of the
-            <email.MIMEMultipart.MIMEMultipart> class. '''
+            <email.MIMEMultipart.MIMEMultipart> class.
+
+            Note : The returned object is cached, so it should be copied
+                   before it's changed. '''
+
+        return self._render()[1]
+
+    def stream (self, chunk_size=constants.STREAM_CHUNK_SIZE,
+                eight_bit=False) :
+        ''' This returns an iterator of the message as MIME formatted string
+            chunks, which joined together are formatted just like
+            <str(self)> (or, with <eight_bit>, like the message made for a
+            server which supports 8BITMIME). Attachment files are read and
+            encoded a chunk at a time, so memory use doesn't grow with the
+            size of the attachments.
+
+            Everything apart from the attachments' content is made, and
+            their files are opened, before this returns (see
+            <Attachment.stream>). '''
+
+        attachments = self._attachment_list(self.attachments)
+
+        message  = self._make(self.from_, self.to, self.body, self.subject,
+                              (), eight_bit)
+        boundary = _make_boundary()
+        message.set_boundary(boundary)
+
+        end  = '\n--%s--\n' % boundary
+        head = message.as_string()[:-len(end)]
+
+        streams = []
+        try :
+            for attachment in attachments :
+                streams.append(attachment.stream(chunk_size, eight_bit))
+        except :
+            for stream in streams :
+                stream.close()
+
+            raise
+
+        return self._stream_chunks(head, boundary, streams, end)
+
+    @staticmethod
+    def _stream_chunks (head, boundary, streams, end) :
+        try :
+            yield head
+
+            for stream in streams :
+                yield '\n--%s\n' % boundary
+                for chunk in stream :
+                    yield chunk
+
+            yield end
+        finally :
+            for stream in streams :
+                stream.close()
+
+    def recipients (self) :
+        ''' This returns the message's unique list of recipients. '''
+
+        return list(self._recipients_for(self.to))
+
+    def attachments_size (self) :
+        ''' This returns the total size of the attachments' files in bytes. '''
+
+        attachments = self._attachment_list(self.attachments)
+        return sum(attachment.size() for attachment in attachments)
+
+    def invalidate (self) :
+        ''' This throws away the cached message, so it's made again the next
+            time it's needed. '''
+
+        self._rendered = None
+
+class _CoalescedMessage (Message) :
+    ''' Several messages with the same content (everything but <to>), which
+        are sent in a single transaction to all of their recipients. The
+        made message's <To> header doesn't list anyone, so recipients can't
+        see who else it went to.
+
+        <messages> : The list of <(index, Message)> tuples merged, where
+                     <index> is the message's position in the batch sent. '''
+
+    _is_coalesced = True
+
+    def __init__ (self, messages) :
+        first = messages[0][1]
+
+        to = []
+        for _, message in messages :
+            to.extend(message.recipients())
+
+        Message.__init__(self, first.from_, to, first.subject, first.body,
+                         first.attachments)
+
+        self.messages = messages
+
+    def _make (self, from_, to, body, subject, attachments,
+               eight_bit=False) :
+        message = Message._make(self, from_, to, body, subject, attachments,
+                                eight_bit)
+        message.replace_header('To', 'undisclosed-recipients:;')
 
-        message = self._make(self.from_, self.to, self.body, self.subject,
-                             self.attachments)
         return message
 
+    def split (self, errors) :
+        ''' This yields each merged message, with its recipients and the
+            <errors> for just those recipients. '''
+
+        for _, message in self.messages :
+            to = message.recipients()
+            yield message, to, dict((recipient, errors[recipient])
+                                    for recipient in to
+                                    if recipient in errors)
+
+    def results (self, result) :
+        ''' This yields an <(index, SendResult)> tuple for each merged
+            message, from the <SendResult> of the whole transaction. A
+            message whose recipients were all refused has failed, even when
+            the others' were accepted. '''
+
+        if not result.succeeded() :
+            for index, message in self.messages :
+                yield index, SendResult(message, exception=result.exception)
+            return
+
+        indexes = [index for index, _ in self.messages]
+        for index, (message, to, errors) in zip(indexes,
+                                                self.split(result.errors)) :
+            if len(errors) == len(to) :
+                exception = smtplib.SMTPRecipientsRefused(errors)
+                yield index, SendResult(message, errors, exception)
+            else :
+                yield index, SendResult(message, errors)
+
+def _coalesce (messages) :
+    ''' This merges messages which only differ in their recipients, and
+        returns the list of messages to send (merged or not), in the order
+        they first appear, along with the position of each in <messages>. '''
+
+    groups = collections.OrderedDict()
+    for index, message in enumerate(messages) :
+        try :
+            state = message._state()
+            key   = state[:1] + state[2:]
+            hash(key)
+        except (AttributeError, TypeError) :
+            # This can't be compared with other messages.
+            key = ('index', index)
+
+        groups.setdefault(key, []).append((index, message))
+
+    coalesced = []
+    for group in groups.itervalues() :
+        if len(group) == 1 :
+            coalesced.append(group[0])
+        else :
+            coalesced.append((None, _CoalescedMessage(group)))
+
+    return coalesced
+
+def _expand (coalesced, results) :
+    ''' This turns the <SendResult> objects of the messages returned by
+        <_coalesce> (or of the first of them) into a <SendResult> for each
+        message they were made from, in the order those were given. '''
+
+    expanded = {}
+    for (index, _), result in zip(coalesced, results) :
+        if index is None :
+            expanded.update(result.message.results(result))
+        else :
+            expanded[index] = result
+
+    return [expanded[index] for index in sorted(expanded)]
+
 class _Hist (_BaseContainer) :
-    ''' This manages a historical list of objects. '''
+    ''' This manages a historical list of objects. Where they're kept is up to
+        <store> (see <email_lib.hist>), by default they're kept in a list. '''
 
-    def __init__ (self, record=True) :
+    def __init__ (self, record=True, store=None) :
         self.set_recording(should_record=record)
 
-        self._past = []
+        if store is None :
+            store = hist.ListStore()
+
+        self.store = store
+        self._lock = threading.Lock()
 
     def _get_container (self) :
-        return self._past
+        return self.store
 
     def set_recording (self, should_record) :
         ''' Should history be recorded? '''
@@ -306,11 +870,125 @@ class _Hist (_BaseContainer) :
         return self._is_recording
 
     def clear (self) :
-        del self._past[:]
+        with self._lock :
+            self.store.clear()
 
     def add (self, item) :
         if self._is_recording :
-            self._past.append(item)
+            with self._lock :
+                self.store.add(item)
+
+    def find (self, recipient=None, since=None, until=None) :
+        ''' This looks up the sent messages with the recipient <recipient>,
+            sent between the times <since> and <until> (in seconds since the
+            epoch). Any of these can be left out. '''
+
+        if recipient is not None :
+            recipient = _Recipients._normalize(recipient)
+
+        with self._lock :
+            return self.store.find(recipient, since, until)
+
+class SendResult (object) :
+    ''' This records the outcome of sending a single <Message> object.
+
+        <message>   : The <Message> object.
+        <errors>    : A dict of the recipients which were refused by the
+                      server, mapping each address to the server's
+                      <(code, response)> reply.
+        <exception> : The exception which stopped the message from being sent,
+                      or <None> if it was sent.
+        <seconds>   : How long sending took (including waiting for a
+                      connection), if it was measured. '''
+
+    def __init__ (self, message, errors=None, exception=None,
+                  seconds=None) :
+        self.message   = message
+        self.errors    = {} if errors is None else errors
+        self.exception = exception
+        self.seconds   = seconds
+
+    def __repr__ (self) :
+        if self.succeeded() :
+            status = 'sent'
+        else :
+            status = 'failed'
+
+        return '<SendResult %s, %d refused>' % (status, len(self.errors))
+
+    def succeeded (self) :
+        ''' Was the message accepted by the server? '''
+
+        return self.exception is None
+
+def _iter_in_threads (items, workers, window, make_worker) :
+    ''' This hands the items of the iterable <items> out to <workers>
+        threads, and yields an <(index, result)> tuple for each as soon as
+        it's done, where <index> is the item's position in <items>. Each
+        thread calls <make_worker()> once, which returns a <(handle, close)>
+        tuple : <handle(item)> returns an item's result, and <close()> is
+        called when the thread stops.
+
+        A thread pulls the next item from the shared iterator when it's
+        ready for one, so <items> is never read into memory all at once.
+        Results are handed over through a queue of at most <window>
+        results, and a thread waits for room before taking another item, so
+        input is only read as fast as results are used. An exception raised
+        by <items> itself is raised here. '''
+
+    items    = enumerate(items)
+    done     = Queue.Queue(window)
+    stop     = threading.Event()
+    lock     = threading.Lock()
+    finished = object()
+
+    def next_item () :
+        with lock :
+            if stop.is_set() :
+                return None
+
+            return next(items, None)
+
+    def work () :
+        handle, close = make_worker()
+        try :
+            while True :
+                item = next_item()
+                if item is None :
+                    break
+
+                index, item = item
+                done.put((index, handle(item)))
+        except Exception as exception :
+            # Something went wrong with <items> itself.
+            done.put((None, exception))
+        finally :
+            close()
+            done.put((finished, None))
+
+    threads = [threading.Thread(target=work) for _ in xrange(workers)]
+    for thread in threads :
+        thread.daemon = True
+        thread.start()
+
+    running = workers
+    try :
+        while running :
+            index, result = done.get()
+            if index is finished :
+                running -= 1
+            elif index is None :
+                raise result
+            else :
+                yield index, result
+    finally :
+        # If the results are abandoned (or the input failed), no more items
+        # are taken, and the queue is emptied until the threads have
+        # finished the items they're handling.
+        stop.set()
+        while running :
+            if done.get()[0] is finished :
+                running -= 1
 
 class EmailServer (object) :
     ''' This class manages the connection to the server. This is merely a
@@ -324,18 +1002,102 @@ class EmailServer (object) :
                         required).
         <record_hist> : If this option is true, then all of the message objects
                         sent will be recorded in an iterable history object
-                        (<self.hist>). '''
+                        (<self.hist>).
+        <hist_store>  : Where the history is kept, e.g., a
+                        <email_lib.hist.RingStore> or
+                        <email_lib.hist.SQLiteStore> object. By default it's
+                        kept in a list.
+        <pool_size>   : The maximum number of connections kept open to the
+                        server (<None> means no limit). Connections are only
+                        kept open between sends if <max_idle> is positive.
+        <max_idle>    : The number of seconds an unused connection is kept
+                        open for, so later sends can skip connecting and
+                        logging in again. By default connections are closed
+                        after every send.
+        <stream_threshold> : Messages whose attachments add up to at least
+                             this many bytes are streamed to the server,
+                             rather than being made in memory first. These
+                             are recorded in the history without their
+                             string form. <None> disables streaming.
+        <max_recipients>   : The most recipients given to the server in a
+                             single transaction. A message with more is sent
+                             in several transactions, and the recipients
+                             refused in each are merged. <None> means no
+                             limit.
+        <rate_limit>       : An <email_lib.ratelimit.RateLimiter> object,
+                             which paces the transactions so the relay's
+                             limits aren't exceeded. It may be shared with
+                             other servers sending through the same relay.
+                             <None> means sends aren't paced.
+        <metrics>          : An <email_lib.metrics.Metrics> object, which is
+                             given the timing of each phase of connecting and
+                             sending, along with counts of connections and
+                             messages.
+        <tls>              : How the connection is secured, <'starttls'>
+                             (the default) upgrades a plain connection,
+                             <'implicit'> uses TLS from the start (SMTPS,
+                             usually port 465, which saves the round trips
+                             STARTTLS takes), and <None> doesn't use TLS.
+        <ssl_context>      : The <ssl.SSLContext> shared by every
+                             connection, e.g., one from
+                             <ssl.create_default_context> to verify the
+                             server's certificate. By default the server
+                             isn't verified, as with <smtplib>.
+        <eight_bit>        : If this is true, text is sent unencoded (8bit)
+                             to servers which support 8BITMIME, when that's
+                             smaller than quoted-printable or base64.
+        <retry>            : An <email_lib.retry.RetryPolicy> object. A
+                             message which fails for a temporary reason (a
+                             4xx reply, or a dropped connection) is tried
+                             again, over a new connection if need be, as
+                             the policy allows. <None> means messages aren't
+                             tried again.
+        <timeout>          : The number of seconds a connection waits on
+                             the server (to connect, or for a reply) before
+                             it's given up on, so a connection which has
+                             silently gone away (e.g., when its health is
+                             checked before reuse) can't block forever.
+                             <None> means it waits forever. '''
 
     _is_email_server = True
 
     def __init__ (self, host, port, username=None, password=None,
-                  record_hist=False) :
-        self.host     = host
-        self.port     = port
-        self.username = username
-        self.password = password
-
-        self.hist = _Hist(record=record_hist)
+                  record_hist=False, pool_size=None, max_idle=0,
+                  stream_threshold=constants.STREAM_THRESHOLD,
+                  max_recipients=constants.MAX_RECIPIENTS, hist_store=None,
+                  rate_limit=None, metrics=None, tls='starttls',
+                  ssl_context=None, eight_bit=True, retry=None,
+                  timeout=constants.TIMEOUT) :
+        if tls not in connection.TLS_MODES :
+            raise ValueError('<tls> has to be one of %s.'
+                             % ', '.join(repr(mode)
+                                         for mode in connection.TLS_MODES))
+
+        self.host        = host
+        self.port        = port
+        self.username    = username
+        self.password    = password
+        self.tls         = tls
+        self.ssl_context = ssl_context
+        self.eight_bit   = eight_bit
+        self.retry       = retry
+        self.timeout     = timeout
+
+        self.stream_threshold = stream_threshold
+        self.max_recipients   = max_recipients
+        self.rate_limit       = rate_limit
+
+        if metrics is None :
+            metrics = NULL_METRICS
+
+        self.metrics = metrics
+
+        self.hist = _Hist(record=record_hist, store=hist_store)
+
+        self.pool = pool.ConnectionPool(self._connect_to_server,
+                                        max_size=pool_size,
+                                        max_idle=max_idle,
+                                        metrics=metrics)
 
     def _log_in (self, server) :
         ''' This attempts to log into the server. '''
@@ -362,18 +1124,35 @@ class EmailServer (object) :
             self.port = str(self.port)
 
         try :
-            server = smtplib.SMTP(host=self.host, port=self.port)
+            start  = time.time()
+            server = connection.connect(self.host, self.port, self.tls,
+                                        self.ssl_context, self.timeout)
+            self.metrics.timing('connect', time.time() - start)
+
+            if self.tls == 'starttls' :
+                start = time.time()
+                server.starttls()
+                self.metrics.timing('starttls', time.time() - start)
+
+            start = time.time()
+            self._log_in(server)
+            self.metrics.timing('login', time.time() - start)
         except socket.gaierror :
+            self.metrics.count('connections_failed')
             raise ValueError('Failed to connect, probably a bad hostname or '
                              'port number.')
+        except :
+            self.metrics.count('connections_failed')
+            raise
         else :
-            server.starttls()
-
-            self._log_in(server)
-
+            self.metrics.count('connections_opened')
             return server
 
-    def _send_individual_message (self, server, message) :
+    def _send_individual_message (self, server, message, progress=None,
+                                  rendered=None) :
+        ''' <progress> is passed on to <_send_batches>. <rendered> is the
+            message as made by <email_lib.render.render>, if it has been. '''
+
         try :
             message.from_
             message.to
@@ -382,21 +1161,159 @@ class EmailServer (object) :
             raise AttributeError('The <EmailServer> class can only send '
                                  '<Message> objects.')
         else :
+            start = time.time()
             from_ = message.from_
-            # With <list(_Recipients(message.to))>, a list is used because
-            # <smtplib> treats a string as a single address (even if it
-            # contains multiple valid addresses).
-            to = list(_Recipients(message.to))
-            literal = unicode(message)
+            # Lists of recipients are used because <smtplib> treats a string
+            # as a single address (even if it contains multiple valid
+            # addresses).
+            recipients = _recipients_of(message)
+            to         = list(recipients)
+
+            # Text is only sent as 8bit if the server takes it, otherwise
+            # it's made as it always is.
+            eight_bit = (self.eight_bit and
+                         hasattr(message, '_is_message') and
+                         transport.supports_eight_bit(server))
+
+            if rendered is not None and rendered[0] and not eight_bit :
+                # It was made for 8BITMIME, which this connection lacks.
+                rendered = None
+
+            if rendered is not None :
+                eight_bit, size, literal, payload = rendered
+                send = lambda batch : transport.send_quoted(
+                                          server, from_, batch, payload,
+                                          self.metrics, eight_bit)
+            elif hasattr(message, '_quoted_parts') :
+                # Only the header block is the message's own, the body is
+                # shared with the rest of its fan-out (see
+                # <email_lib.fanout.FanOut>), and written from the one copy.
+                parts   = message._quoted_parts(eight_bit)
+                literal = (message._as_string(eight_bit)
+                           if self.hist.is_recording() else None)
+                size    = sum(len(part) for part in parts)
+                send    = lambda batch : transport.send_parts(
+                                             server, from_, batch, parts,
+                                             self.metrics, eight_bit)
+            elif self._should_stream(message) :
+                # The message is never held in memory as a whole.
+                literal = None
+                size    = message.attachments_size()
+                chunks  = lambda : (message.stream(eight_bit=True)
+                                    if eight_bit else message.stream())
+                send    = lambda batch : transport.send_stream(
+                                             server, from_, batch, chunks(),
+                                             self.metrics, eight_bit)
+            else :
+                # The message is quoted once, however many transactions it
+                # takes, and stays a byte string all the way to the socket.
+                literal = (message._as_string(eight_bit=True) if eight_bit
+                           else str(message))
+                size    = len(literal)
+                payload = transport.quote(literal)
+                send    = lambda batch : transport.send_quoted(
+                                             server, from_, batch, payload,
+                                             self.metrics, eight_bit)
+
+            # A failure isn't counted here, since the message may be tried
+            # again (see <_send_retrying>).
+            errors = self._send_batches(
+                         self._paced(send, size),
+                         recipients.batches(self.max_recipients),
+                         progress)
+
+            self.metrics.timing('message', time.time() - start, size)
+            self.metrics.count('messages_sent')
+            if errors :
+                self.metrics.count('recipients_refused', len(errors))
+
+            date_time = iso_time.iso_date_time()
+            if hasattr(message, '_is_coalesced') :
+                # Each of the merged messages is recorded on its own.
+                for original, to, original_errors in message.split(errors) :
+                    self.hist.add((original, from_, to, literal,
+                                   original_errors, date_time))
+            else :
+                self.hist.add((message, from_, to, literal, errors,
+                               date_time))
+
+            return errors
+
+    def _paced (self, send, size) :
+        ''' This wraps a transaction, so it waits on the rate limiter first.
+            For a streamed message <size> only counts the attachments, as
+            the whole message is never measured. '''
+
+        if self.rate_limit is None :
+            return send
+
+        def paced_send (batch) :
+            self.rate_limit.wait(len(batch), size)
+            return send(batch)
+
+        return paced_send
+
+    def _send_batches (self, send, batches, progress=None) :
+        ''' Each batch of recipients is sent in its own transaction. When
+            there's more than one, a batch which fails as a whole has each of
+            its recipients counted as refused, and an exception is only
+            raised if every recipient is refused. A refused sender is only
+            counted against the batch once an earlier batch has gone out,
+            otherwise the message as a whole is refused.
+
+            <progress> is a dict of the batches already accepted (by their
+            position) when the message was last tried, mapping each to its
+            refused recipients. Those batches aren't sent again, and batches
+            which are accepted now are added to it. '''
+
+        if len(batches) == 1 :
+            return send(batches[0])
+
+        if progress is None :
+            progress = {}
+
+        errors = {}
+        for index, batch in enumerate(batches) :
+            if index in progress :
+                errors.update(progress[index])
+                continue
 
             try :
-                errors = server.sendmail(from_, to, literal)
-            except smtplib.SMTPSenderRefused :
-                raise
-            else :
-                info = (message, from_, to, literal, errors,
-                        iso_time.iso_date_time())
-                self.hist.add(info)
+                progress[index] = send(batch)
+                errors.update(progress[index])
+            except smtplib.SMTPRecipientsRefused as exception :
+                errors.update(exception.recipients)
+            except smtplib.SMTPSenderRefused as exception :
+                if not progress :
+                    raise
+
+                # The transaction has already been reset (see
+                # <email_lib.transport>).
+                for recipient in batch :
+                    errors[recipient] = (exception.smtp_code,
+                                         exception.smtp_error)
+            except smtplib.SMTPDataError as exception :
+                # The transaction has already been reset (see
+                # <email_lib.transport>).
+                for recipient in batch :
+                    errors[recipient] = (exception.smtp_code,
+                                         exception.smtp_error)
+
+        if len(errors) == sum(len(batch) for batch in batches) :
+            raise smtplib.SMTPRecipientsRefused(errors)
+
+        return errors
+
+    def _should_stream (self, message) :
+        if self.stream_threshold is None :
+            return False
+
+        try :
+            size = message.attachments_size()
+        except AttributeError :
+            return False
+        else :
+            return size >= self.stream_threshold
 
     def _test (self) :
         ''' This tests if a connection to the server can be made. This does not
@@ -407,19 +1324,243 @@ class EmailServer (object) :
         server = self._connect_to_server()
         server.quit()
 
-    def send (self, messages) :
-        ''' Send an individual <Message> object, or an iterable container,
-            e.g., <list>, <set>, <tuple> of <Message> objects. '''
+    def _send_retrying (self, held, message, rendered=None) :
+        ''' This sends <message>, trying it again as the retry policy allows,
+            and returns its refused recipients (or raises the last exception).
+            <held> is a list holding the pooled connection to send over, or
+            <None> to acquire one, and afterwards it holds the connection to
+            send the next message over. A connection which fails is
+            discarded, and the message is tried again over a new one, without
+            sending any of its transactions which were already accepted. '''
+
+        progress = {}
+        tries    = 0
+        while True :
+            tries += 1
+            try :
+                if held[0] is None :
+                    held[0] = self.pool.acquire()
+
+                return self._send_individual_message(held[0], message,
+                                                     progress, rendered)
+            except Exception :
+                exc_info  = sys.exc_info()
+                exception = exc_info[1]
+
+                if (held[0] is not None and
+                    (isinstance(exception, pool.CONNECTION_ERRORS) or
+                     pool.is_closed(held[0]))) :
+                    self.pool.release(held[0], discard=True)
+                    held[0] = None
+
+                if (self.retry is None or
+                    not self.retry.should_retry(exception, tries)) :
+                    # Only a message which is given up on counts as failed,
+                    # failed tries are counted as <messages_retried>.
+                    self.metrics.count('messages_failed')
+                    raise exc_info[0], exc_info[1], exc_info[2]
+
+            self.metrics.count('messages_retried')
+            time.sleep(self.retry.delay(tries))
+
+    def _deliver (self, held, message, rendered=None) :
+        ''' This sends <message> (see <_send_retrying>), and returns its
+            <SendResult>. '''
+
+        start = time.time()
+        try :
+            errors = self._send_retrying(held, message, rendered)
+        except Exception as exception :
+            result = SendResult(message, exception=exception)
+        else :
+            result = SendResult(message, errors)
 
-        server = self._connect_to_server()
+        result.seconds = time.time() - start
+
+        return result
+
+    def _iter_serially (self, messages) :
+        held = [None]
+        try :
+            for index, message in enumerate(messages) :
+                yield index, self._deliver(held, message)
+        finally :
+            if held[0] is not None :
+                self.pool.release(held[0])
+
+    def _iter_in_parallel (self, messages, workers, window) :
+        ''' Each worker thread holds its own connection, and sends the
+            <(message, rendered)> tuples (see <_send_individual_message>)
+            from <messages> (see <_iter_in_threads>). '''
+
+        def make_worker () :
+            held = [None]
+
+            def close () :
+                if held[0] is not None :
+                    self.pool.release(held[0])
+
+            return lambda item : self._deliver(held, *item), close
+
+        return _iter_in_threads(messages, workers, window, make_worker)
+
+    def _send_serially (self, messages) :
+        ''' The first message which can't be sent stops the others. Its
+            exception is raised with a <results> attribute, the list of
+            <SendResult> objects of the messages sent before it, so it's
+            known which went out. '''
+
+        results = []
+        held    = [None]
+        try :
+            for message in messages :
+                try :
+                    errors = self._send_retrying(held, message)
+                except Exception as exception :
+                    exception.results = results
+                    raise
+
+                results.append(SendResult(message, errors))
+        finally :
+            if held[0] is not None :
+                self.pool.release(held[0])
+
+        return results
+
+    def _iter_rendered (self, messages, workers, window, processes) :
+        ''' The messages are made in <processes> worker processes (see
+            <email_lib.render.Renderer>), while <workers> connections send
+            the ones already made. '''
+
+        import email_lib.render as render
+
+        # The messages are made for the server's extensions before any
+        # connection they're sent over is known.
+        with self.pool.connection() as server :
+            eight_bit = self.eight_bit and transport.supports_eight_bit(server)
+
+        # Fanned out messages are already made once for all of them.
+        should_render = lambda message : (
+                            hasattr(message, '_is_message') and
+                            not hasattr(message, '_quoted_parts') and
+                            not self._should_stream(message))
+
+        renderer = render.Renderer(messages, processes, eight_bit,
+                                   self.hist.is_recording(), window,
+                                   should_render)
+        try :
+            for item in self._iter_in_parallel(renderer, workers,
+                                               window or workers) :
+                yield item
+        finally :
+            renderer.close()
+
+    def _send_in_parallel (self, messages, workers) :
+        results = dict(self._iter_in_parallel(((message, None)
+                                               for message in messages),
+                                              workers, workers))
+        return [results[index] for index in xrange(len(results))]
+
+    def send_iter (self, messages, workers=None, window=None,
+                   render_processes=None) :
+        ''' This sends the <Message> objects from the iterable <messages>
+            (e.g., a generator), yielding an <(index, SendResult)> tuple for
+            each as soon as it has been sent, where <index> is the message's
+            position in <messages>. Messages are only taken from <messages>
+            as fast as results are taken from this, so any number can be
+            streamed through with bounded memory use.
+
+            A message which fails to send doesn't stop the others, its
+            exception is recorded in its <SendResult> instead.
+
+            <workers> : If this is given, the messages are spread across this
+                        many concurrent connections (limited by the pool's
+                        <pool_size>), and results are yielded in the order
+                        the messages finish.
+            <window>  : The most results held for the caller, when there are
+                        <workers> (the same number as <workers> by
+                        default).
+            <render_processes> : If this is given, messages are made in this
+                                 many worker processes, while the
+                                 connections send the ones already made, so
+                                 making messages with large attachments
+                                 isn't held up by the GIL, or by waiting on
+                                 the server. Messages (and their
+                                 attachments) have to be picklable. At most
+                                 <window> messages (twice the number of
+                                 processes by default) are made ahead. '''
+
+        if hasattr(messages, '_is_message') :
+            messages = (messages,)
+
+        if render_processes is not None :
+            return self._iter_rendered(messages, max(1, int(workers or 1)),
+                                       window, max(1, int(render_processes)))
+
+        if workers is None :
+            return self._iter_serially(messages)
+
+        workers = max(1, int(workers))
+        return self._iter_in_parallel(((message, None)
+                                       for message in messages),
+                                      workers, window or workers)
+
+    def send (self, messages, workers=None, coalesce=False,
+              render_processes=None) :
+        ''' Send an individual <Message> object, or an iterable container,
+            e.g., <list>, <set>, <tuple> of <Message> objects. A list of
+            <SendResult> objects is returned, in the same order as
+            <messages>.
+
+            <workers>  : If this is given, the messages are spread across this
+                         many concurrent connections (limited by the pool's
+                         <pool_size>). In this mode a message which fails to
+                         send doesn't stop the others, its exception is
+                         recorded in its <SendResult> instead.
+            <coalesce> : If this is true, messages which only differ in their
+                         recipients are merged, and sent (and made) once to
+                         all of their recipients, with a <To> header of
+                         "undisclosed-recipients". Each message still gets
+                         its own history entry and <SendResult>. <messages>
+                         is read into memory all at once to find them.
+            <render_processes> : If this is given, messages are made in this
+                                 many worker processes while others are sent
+                                 (see <send_iter>). As with <workers>, a
+                                 failed message doesn't stop the others. '''
 
         if hasattr(messages, '_is_message') :
             # A single message is sent.
-            message  = messages
-            messages = [message]
+            messages = (messages,)
 
-        for message in messages :
-            self._send_individual_message(server, message)
+        if coalesce :
+            return self._send_coalesced(messages, workers, render_processes)
 
-        server.quit()
+        if render_processes is not None :
+            results = dict(self.send_iter(messages, workers,
+                                          render_processes=render_processes))
+            return [results[index] for index in xrange(len(results))]
+
+        if workers is None :
+            return self._send_serially(messages)
+        else :
+            return self._send_in_parallel(messages, max(1, int(workers)))
+
+    def _send_coalesced (self, messages, workers, render_processes) :
+        coalesced = _coalesce(list(messages))
+        try :
+            results = self.send([message for _, message in coalesced],
+                                workers, render_processes=render_processes)
+        except Exception as exception :
+            # The results of the messages sent before the failure (see
+            # <_send_serially>) are given for the messages passed in.
+            if hasattr(exception, 'results') :
+                exception.results = _expand(coalesced, exception.results)
+            raise
+
+        return _expand(coalesced, results)
+
+    def close (self) :
+        ''' This closes any connections being kept open by the pool. '''
+
+        self.pool.close()
 
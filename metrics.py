@@ -0,0 +1,104 @@
+''' This module contains the instrumentation hooks. <EmailServer>, its
+    connection pool, and <Message> report how long each phase of sending
+    takes (and how many bytes it handled), along with counts of events, to a
+    metrics object. The default object ignores everything, a subclass can
+    pass it on to any monitoring system.
+
+    The phases are :
+
+        <connect>  : Looking up the host, and opening the TCP connection
+                     (with implicit TLS, this includes the handshake).
+        <starttls> : The TLS handshake.
+        <login>    : Authenticating.
+        <make>     : Making a <Message>'s MIME object.
+        <generate> : Turning the MIME object into a string (with its size).
+        <envelope> : The MAIL, RCPT and DATA commands, up to the server being
+                     ready for the message.
+        <data>     : Writing the message, up to the server accepting it (with
+                     its size).
+        <message>  : Sending a whole message, from start to finish.
+
+    The counts are <connections_opened>, <connections_reused>,
+    <connections_failed>, <connections_discarded>, <messages_sent>,
+    <messages_failed>, <messages_retried> and <recipients_refused>. '''
+
+
+import threading
+
+__all__ = ['Metrics', 'MetricsRecorder', 'NULL_METRICS']
+
+class Metrics (object) :
+    ''' The metrics interface, which ignores everything it's given. Methods
+        may be called from several threads at once. '''
+
+    def timing (self, phase, seconds, size=None) :
+        ''' <phase> took <seconds>, and handled <size> bytes (if it's
+            known). '''
+
+        pass
+
+    def count (self, name, amount=1) :
+        ''' The event <name> happened <amount> times. '''
+
+        pass
+
+''' The metrics object used wherever one isn't given, which is shared by
+    every module. '''
+NULL_METRICS = Metrics()
+
+class _PhaseStats (object) :
+    def __init__ (self) :
+        self.count   = 0
+        self.total   = 0.0
+        self.longest = 0.0
+        self.bytes   = 0
+
+    def as_dict (self) :
+        return {'count'   : self.count,
+                'total'   : self.total,
+                'mean'    : self.total / self.count if self.count else 0.0,
+                'longest' : self.longest,
+                'bytes'   : self.bytes}
+
+class MetricsRecorder (Metrics) :
+    ''' This adds up everything it's given in memory, for a monitoring system
+        to poll with <snapshot>. '''
+
+    def __init__ (self) :
+        self._lock   = threading.Lock()
+        self._phases = {}
+        self._counts = {}
+
+    def timing (self, phase, seconds, size=None) :
+        with self._lock :
+            stats = self._phases.get(phase)
+            if stats is None :
+                stats = self._phases[phase] = _PhaseStats()
+
+            stats.count   += 1
+            stats.total   += seconds
+            stats.longest  = max(stats.longest, seconds)
+            if size is not None :
+                stats.bytes += size
+
+    def count (self, name, amount=1) :
+        with self._lock :
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def snapshot (self) :
+        ''' This returns a dict with the <phases> (a dict of each phase's
+            <count>, <total>, <mean> and <longest> time in seconds, and
+            <bytes>), and the <counts>. '''
+
+        with self._lock :
+            return {'phases' : dict((phase, stats.as_dict())
+                                    for phase, stats
+                                    in self._phases.iteritems()),
+                    'counts' : dict(self._counts)}
+
+    def reset (self) :
+        ''' This sets everything back to zero. '''
+
+        with self._lock :
+            self._phases.clear()
+            self._counts.clear()
@@ -0,0 +1,222 @@
+''' This module contains the connection pool, which allows authenticated SMTP
+    sessions to be reused between sends instead of reconnecting every time. '''
+
+
+import time
+import socket
+import smtplib
+import threading
+import contextlib
+import collections
+
+from email_lib.metrics import NULL_METRICS
+
+__all__ = ['ConnectionPool', 'is_closed']
+
+''' Exceptions which mean a connection can't be used any more. '''
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected,
+                     smtplib.SMTPConnectError,
+                     socket.error)
+
+def is_closed (server) :
+    ''' This tells if a connection has been closed (e.g., by
+        <email_lib.transport>, after a message failed part way through). '''
+
+    return getattr(server, 'sock', None) is None
+
+class _PooledConnection (object) :
+    ''' A connection held by the pool, along with when it was last used. '''
+
+    def __init__ (self, server) :
+        self.server    = server
+        self.last_used = time.time()
+
+class ConnectionPool (object) :
+    ''' This class keeps a bounded set of authenticated SMTP connections
+        alive, and hands them out to (possibly concurrent) callers.
+
+        <connect>  : A callable which returns a new, authenticated
+                     <smtplib.SMTP> object.
+        <max_size> : The maximum number of connections which may be open at
+                     once, counting the ones currently handed out. <None>
+                     means no limit.
+        <max_idle> : The number of seconds an idle connection is kept for. An
+                     idle connection older than this is closed, and <0> means
+                     connections are closed as soon as they're released.
+        <timeout>  : The number of seconds <acquire> waits for a connection
+                     when the pool is full. <None> means wait forever.
+        <metrics>  : An <email_lib.metrics.Metrics> object, which counts the
+                     connections reused and discarded. '''
+
+    def __init__ (self, connect, max_size=None, max_idle=60.0, timeout=None,
+                  metrics=None) :
+        self.connect  = connect
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout  = timeout
+
+        if metrics is None :
+            metrics = NULL_METRICS
+
+        self.metrics = metrics
+
+        self._idle      = collections.deque()
+        self._size      = 0
+        self._condition = threading.Condition(threading.Lock())
+
+    def __len__ (self) :
+        ''' The number of open connections, including the ones handed out. '''
+
+        return self._size
+
+    def _close (self, server) :
+        try :
+            server.quit()
+        except (smtplib.SMTPException, socket.error) :
+            server.close()
+
+    def _is_alive (self, server) :
+        ''' A <RSET> both checks that the session is still usable, and clears
+            any transaction left behind by a previous user. '''
+
+        try :
+            code = server.rset()[0]
+        except (smtplib.SMTPException, socket.error) :
+            return False
+        else :
+            return code == 250
+
+    def _pop_expired (self) :
+        ''' This removes expired connections from the idle queue, and returns
+            them so they can be closed outside of the lock. The oldest
+            connections are at the left of the queue. '''
+
+        expired = []
+        now     = time.time()
+        while self._idle and now - self._idle[0].last_used > self.max_idle :
+            expired.append(self._idle.popleft())
+            self._size -= 1
+
+        return expired
+
+    def _is_full (self) :
+        return self.max_size is not None and self._size >= self.max_size
+
+    def acquire (self) :
+        ''' This returns a connection from the pool, opening a new one if
+            there are no healthy idle connections. If the pool is full, this
+            blocks until another caller releases a connection. '''
+
+        while True :
+            with self._condition :
+                expired = self._pop_expired()
+
+                deadline = None
+                if self.timeout is not None :
+                    deadline = time.time() + self.timeout
+
+                while not self._idle and self._is_full() :
+                    if deadline is None :
+                        self._condition.wait()
+                    else :
+                        remaining = deadline - time.time()
+                        if remaining <= 0 :
+                            raise RuntimeError('Timed out waiting for a '
+                                               'connection from the pool.')
+                        self._condition.wait(remaining)
+
+                    expired += self._pop_expired()
+
+                if self._idle :
+                    # The most recently used connection is the most likely
+                    # to still be alive.
+                    pooled = self._idle.pop()
+                else :
+                    pooled = None
+                    self._size += 1
+
+            for old in expired :
+                self._close(old.server)
+
+            if pooled is None :
+                try :
+                    return self.connect()
+                except :
+                    self._discard_slot()
+                    raise
+            elif self._is_alive(pooled.server) :
+                self.metrics.count('connections_reused')
+                return pooled.server
+            else :
+                self.metrics.count('connections_discarded')
+                pooled.server.close()
+                self._discard_slot()
+
+    def _discard_slot (self) :
+        with self._condition :
+            self._size -= 1
+            self._condition.notify()
+
+    def release (self, server, discard=False) :
+        ''' This returns a connection to the pool. A connection which is known
+            to be broken should be released with <discard=True>, and one which
+            has been closed is always discarded. '''
+
+        discard = discard or is_closed(server)
+        if discard or self.max_idle <= 0 :
+            if discard :
+                self.metrics.count('connections_discarded')
+                server.close()
+            else :
+                self._close(server)
+
+            self._discard_slot()
+            return
+
+        with self._condition :
+            self._idle.append(_PooledConnection(server))
+            expired = self._pop_expired()
+            self._condition.notify()
+
+        for old in expired :
+            self._close(old.server)
+
+    @contextlib.contextmanager
+    def connection (self) :
+        ''' A context manager which acquires a connection, and releases it
+            afterwards. If a connection level error is raised, the connection
+            is discarded instead of being returned to the pool. '''
+
+        server = self.acquire()
+        try :
+            yield server
+        except CONNECTION_ERRORS :
+            self.release(server, discard=True)
+            raise
+        except :
+            self.release(server)
+            raise
+        else :
+            self.release(server)
+
+    def prune (self) :
+        ''' This closes any idle connections which have expired. '''
+
+        with self._condition :
+            expired = self._pop_expired()
+
+        for old in expired :
+            self._close(old.server)
+
+    def close (self) :
+        ''' This closes every idle connection. Connections which are currently
+            handed out aren't affected. '''
+
+        with self._condition :
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for pooled in idle :
+            self._close(pooled.server)
@@ -0,0 +1,135 @@
+''' This module contains token bucket rate limiters, which pace sends so that
+    a relay's limits (e.g., messages per second, or bytes per hour) are never
+    exceeded, rather than being found out through 421 or 451 replies. '''
+
+
+import time
+import threading
+
+__all__ = ['TokenBucket', 'RateLimiter']
+
+class TokenBucket (object) :
+    ''' A bucket which is refilled with <rate> tokens every <per> seconds, and
+        holds at most <burst> tokens.
+
+        Taking tokens never fails, it returns how long the caller has to wait
+        before going ahead. Tokens are reserved straight away, so concurrent
+        callers queue up behind each other rather than all waking up at once.
+        Taking more than <burst> tokens at a time is allowed, the bucket just
+        goes into debt, and later callers wait for it to be paid off.
+
+        <rate>  : The number of tokens added every <per> seconds.
+        <per>   : The length of the period, in seconds.
+        <burst> : The most tokens which can build up while the bucket isn't
+                  used. This is also how many it starts with. '''
+
+    def __init__ (self, rate, per=1.0, burst=None) :
+        if rate <= 0 or per <= 0 :
+            raise ValueError('A token bucket needs a positive rate and '
+                             'period.')
+
+        if burst is None :
+            burst = rate
+
+        self.rate  = float(rate)
+        self.per   = float(per)
+        self.burst = float(burst)
+
+        self._tokens  = self.burst
+        self._updated = time.time()
+        self._lock    = threading.Lock()
+
+    def _refill (self, now) :
+        self._tokens  = min(self.burst,
+                            self._tokens +
+                            (now - self._updated) * self.rate / self.per)
+        self._updated = now
+
+    def reserve (self, amount=1) :
+        ''' This takes <amount> tokens, and returns the number of seconds to
+            wait before using them. '''
+
+        with self._lock :
+            now = time.time()
+            self._refill(now)
+
+            # Anything bigger than the bucket only has to wait for a full one.
+            needed = min(amount, self.burst) - self._tokens
+            self._tokens -= amount
+
+        if needed <= 0 :
+            return 0.0
+
+        return needed * self.per / self.rate
+
+    def tokens (self) :
+        ''' The number of tokens available now (negative while in debt). '''
+
+        with self._lock :
+            self._refill(time.time())
+            return self._tokens
+
+class RateLimiter (object) :
+    ''' This paces the transactions sent to one relay, so that none of its
+        limits are exceeded. A single limiter may be shared by several
+        <EmailServer> objects (and threads) which send through the same
+        relay.
+
+        <messages_per_second>   : The most transactions per second.
+        <recipients_per_minute> : The most recipients per minute.
+        <bytes_per_hour>        : The most message bytes per hour.
+        <headroom>              : The fraction of each limit which is held
+                                  back. It's used as the burst allowed after
+                                  a quiet spell, and the rest is the steady
+                                  rate, so no period ever sees more than the
+                                  limit itself.
+
+        Any limit which is <None> isn't enforced. '''
+
+    def __init__ (self, messages_per_second=None, recipients_per_minute=None,
+                  bytes_per_hour=None, headroom=0.05) :
+        if not 0 <= headroom < 1 :
+            raise ValueError('The headroom must be at least 0 and less than '
+                             '1.')
+
+        self.headroom = headroom
+
+        self.messages   = self._make_bucket(messages_per_second, 1.0)
+        self.recipients = self._make_bucket(recipients_per_minute, 60.0)
+        self.bytes      = self._make_bucket(bytes_per_hour, 3600.0)
+
+        self.waited = 0.0
+
+        self._lock = threading.Lock()
+
+    def _make_bucket (self, limit, per) :
+        if limit is None :
+            return None
+
+        burst = limit * self.headroom
+        return TokenBucket(limit - burst, per, burst)
+
+    def reserve (self, recipients=1, size=0) :
+        ''' This accounts for a transaction with <recipients> recipients and
+            <size> bytes, and returns the number of seconds to wait before
+            sending it. '''
+
+        delays = [0.0]
+        for bucket, amount in ((self.messages, 1),
+                               (self.recipients, recipients),
+                               (self.bytes, size)) :
+            if bucket is not None and amount :
+                delays.append(bucket.reserve(amount))
+
+        return max(delays)
+
+    def wait (self, recipients=1, size=0) :
+        ''' This blocks until a transaction with <recipients> recipients and
+            <size> bytes may be sent. '''
+
+        delay = self.reserve(recipients, size)
+        if delay > 0 :
+            with self._lock :
+                self.waited += delay
+
+            time.sleep(delay)
@@ -0,0 +1,255 @@
+''' This module contains the relay group, which spreads messages across
+    several SMTP relays (each one an <EmailServer>), and routes around relays
+    which are slow or failing. '''
+
+
+import time
+import random
+import smtplib
+import threading
+
+import email_lib.transport as transport
+import email_lib.lib as lib
+
+__all__ = ['RelayGroup']
+
+def _is_relay_fault (exception) :
+    ''' This tells if a send which failed with <exception>, once connected,
+        failed because of the relay rather than the message : a temporary
+        failure, or the relay refusing the sender outright (e.g., 530 when
+        it wants authentication, or 554 when it won't relay). Failing to
+        connect, log in or start TLS is always the relay's fault. '''
+
+    return (transport.is_transient(exception) or
+            isinstance(exception, smtplib.SMTPSenderRefused))
+
+class _Relay (object) :
+    ''' A relay in a group, along with its health. '''
+
+    def __init__ (self, server, weight) :
+        self.server = server
+        self.weight = float(weight)
+
+        self.latency    = None
+        self.failures   = 0
+        self.down_until = 0.0
+        self.sent       = 0
+        self.failed     = 0
+
+    @property
+    def name (self) :
+        return '%s:%s' % (self.server.host, self.server.port)
+
+    def is_up (self, now) :
+        return self.down_until <= now
+
+class RelayGroup (object) :
+    ''' This class sends messages through several relays, with the same
+        interface as <EmailServer>. Each message goes to one relay, which is
+        picked at random in proportion to its weight, divided by its average
+        latency, so slow relays get less traffic. Relays which keep failing
+        are taken out of rotation for a while, and a message which fails on
+        one relay for a temporary reason (a connection problem, or a 4xx
+        reply), or because of the relay itself (see <_is_relay_fault>), is
+        sent through another.
+
+        <relays>       : A list of <EmailServer> objects, or of
+                         <(EmailServer, weight)> tuples. Weights default to 1.
+        <routes>       : A dict which maps recipient domains to lists of
+                         <EmailServer> objects (from <relays>). A message is
+                         routed by its first recipient whose domain has a
+                         route, and can only be sent through those relays.
+                         Other messages can use any relay.
+        <max_failures> : The number of failures in a row which takes a relay
+                         out of rotation.
+        <cooldown>     : The number of seconds a failing relay is left out
+                         for, before it's tried again.
+        <max_tries>    : The most relays a single message is tried on.
+        <smoothing>    : How much each send counts towards a relay's average
+                         latency, from 0 to 1. '''
+
+    def __init__ (self, relays, routes=None, max_failures=3, cooldown=30.0,
+                  max_tries=3, smoothing=0.2) :
+        self.relays = []
+        for relay in relays :
+            if isinstance(relay, tuple) :
+                server, weight = relay
+            else :
+                server, weight = relay, 1
+
+            self.relays.append(_Relay(server, weight))
+
+        if not self.relays :
+            raise ValueError('A relay group needs at least one relay.')
+
+        self.routes = {}
+        for domain, servers in (routes or {}).iteritems() :
+            self.routes[domain.lower()] = [self._relay_for(server)
+                                           for server in servers]
+
+        self.max_failures = max_failures
+        self.cooldown     = cooldown
+        self.max_tries    = max_tries
+        self.smoothing    = smoothing
+
+        self._lock = threading.Lock()
+
+    def _relay_for (self, server) :
+        for relay in self.relays :
+            if relay.server is server :
+                return relay
+
+        raise ValueError('Routes can only use servers in the group.')
+
+    def _candidates (self, message) :
+        if self.routes :
+            for recipient in lib._recipients_of(message) :
+                domain = recipient.rpartition('@')[2].lower()
+                if domain in self.routes :
+                    return self.routes[domain]
+
+        return self.relays
+
+    def _choose (self, candidates, tried) :
+        ''' This picks a relay which hasn't been tried yet. If every relay
+            left is out of rotation, the one which is due back soonest is
+            used anyway. '''
+
+        with self._lock :
+            now  = time.time()
+            left = [relay for relay in candidates if relay not in tried]
+            if not left :
+                return None
+
+            up = [relay for relay in left if relay.is_up(now)]
+            if not up :
+                return min(left, key=lambda relay : relay.down_until)
+
+            # Relays without a latency yet are assumed to be as fast as the
+            # fastest one, so they get tried.
+            latencies = [relay.latency for relay in up
+                         if relay.latency is not None]
+            fastest   = min(latencies) if latencies else 1.0
+
+            scores = [relay.weight / max(relay.latency or fastest, 1e-6)
+                      for relay in up]
+
+        point = random.uniform(0, sum(scores))
+        for relay, score in zip(up, scores) :
+            point -= score
+            if point <= 0 :
+                return relay
+
+        return up[-1]
+
+    def _record (self, relay, seconds, failed, is_relay_fault=False) :
+        ''' Every failure is counted, but only those which are the relay's
+            fault count against its health. '''
+
+        with self._lock :
+            if failed :
+                relay.failed += 1
+                if is_relay_fault :
+                    relay.failures += 1
+                    if relay.failures >= self.max_failures :
+                        relay.down_until = time.time() + self.cooldown
+            else :
+                relay.sent    += 1
+                relay.failures = 0
+
+            if seconds is None :
+                # Failures say nothing about how fast the relay is.
+                return
+            elif relay.latency is None :
+                relay.latency = seconds
+            else :
+                relay.latency += self.smoothing * (seconds - relay.latency)
+
+    def _send_one (self, message) :
+        ''' This sends a message through one relay after another, until it's
+            sent or it fails for a reason another relay won't fix. '''
+
+        candidates = self._candidates(message)
+        tried      = set()
+        result     = None
+        last       = None
+
+        while len(tried) < self.max_tries :
+            relay = self._choose(candidates, tried)
+            if relay is None :
+                break
+
+            tried.add(relay)
+            last      = relay
+            start     = time.time()
+            connected = False
+            try :
+                with relay.server.pool.connection() as server :
+                    connected = True
+                    errors    = relay.server._send_individual_message(
+                                    server, message)
+            except Exception as exception :
+                result   = lib.SendResult(message, exception=exception)
+                is_fault = not connected or _is_relay_fault(exception)
+
+                self._record(relay, None, True, is_fault)
+                if not is_fault :
+                    # Another relay would fail the message the same way.
+                    break
+            else :
+                self._record(relay, time.time() - start, False)
+                return lib.SendResult(message, errors)
+
+        if last is not None :
+            # The message is given up on, once, by the last relay tried
+            # (<relay> is <None> if the candidates ran out).
+            last.server.metrics.count('messages_failed')
+
+        return result
+
+    def send (self, messages, workers=None) :
+        ''' Send an individual <Message> object, or an iterable of them, and
+            return a list of <SendResult> objects in the same order. A message
+            which fails doesn't stop the others, its exception is recorded in
+            its <SendResult> instead.
+
+            <workers> : The number of concurrent senders, which are shared by
+                        all of the relays. By default messages are sent one at
+                        a time. Connections are only kept open between
+                        messages by relays with a positive <max_idle>. '''
+
+        if hasattr(messages, '_is_message') :
+            messages = [messages]
+
+        if workers is None :
+            return [self._send_one(message) for message in messages]
+
+        # Relays have no connection to hold between messages (each uses its
+        # own pool), so the workers only send.
+        workers = max(1, int(workers))
+        results = dict(lib._iter_in_threads(
+                           messages, workers, workers,
+                           lambda : (self._send_one, lambda : None)))
+
+        return [results[index] for index in xrange(len(results))]
+
+    def stats (self) :
+        ''' This returns a dict for each relay, with its name, how many
+            messages it sent and failed, its average latency in seconds, and
+            whether it's in rotation. '''
+
+        with self._lock :
+            now = time.time()
+            return [{'name'    : relay.name,
+                     'weight'  : relay.weight,
+                     'sent'    : relay.sent,
+                     'failed'  : relay.failed,
+                     'latency' : relay.latency,
+                     'up'      : relay.is_up(now)}
+                    for relay in self.relays]
+
+    def close (self) :
+        ''' This closes any connections kept open by the relays' pools. '''
+
+        for relay in self.relays :
+            relay.server.close()
@@ -0,0 +1,131 @@
+''' This module renders messages in worker processes, into the bytes written
+    after DATA. Making a message with large attachments is CPU bound, and
+    threads can't share that work (the GIL), so <EmailServer> can render in a
+    process pool while its connections send what's already been rendered. '''
+
+
+import collections
+import multiprocessing
+import threading
+
+import email_lib.transport as transport
+
+__all__ = ['render', 'Renderer']
+
+def render (message, eight_bit=False, keep_literal=True) :
+    ''' This renders <message>, and returns an <(eight_bit, size, literal,
+        payload)> tuple : whether it was made for a server which supports
+        8BITMIME, its size, its string form (or <None> unless
+        <keep_literal>), and the string quoted by <transport.quote>. '''
+
+    if eight_bit :
+        literal = message._as_string(eight_bit=True)
+    else :
+        literal = str(message)
+
+    return (eight_bit, len(literal), literal if keep_literal else None,
+            transport.quote(literal))
+
+def _render_task (task) :
+    message, eight_bit, keep_literal, should_render = task
+    if not should_render :
+        return None
+
+    try :
+        return render(message, eight_bit, keep_literal)
+    except Exception :
+        # The message is left for the sender to make, which raises the same
+        # error where it can be recorded against the message.
+        return None
+
+class Renderer (object) :
+    ''' An iterator which renders the messages from the iterable <messages>
+        in a pool of <processes> processes (one per core by default), and
+        yields a <(message, rendered)> tuple for each, in order, where
+        <rendered> is what <render> returns. It's <None> for a message which
+        <should_render> turns down (e.g., one which is streamed), or which
+        couldn't be rendered (or pickled), so the sender makes it instead.
+
+        No more than <window> messages are taken from <messages> before
+        their results are, so messages are only rendered as fast as they're
+        used. It should be closed (with <close>) if it isn't used up. '''
+
+    def __init__ (self, messages, processes=None, eight_bit=False,
+                  keep_literal=True, window=None, should_render=None) :
+        if processes is None :
+            processes = multiprocessing.cpu_count()
+
+        if window is None :
+            window = 2 * processes
+
+        if should_render is None :
+            should_render = lambda message : True
+
+        self._messages      = iter(messages)
+        self._eight_bit     = eight_bit
+        self._keep_literal  = keep_literal
+        self._should_render = should_render
+        self._slots         = threading.Semaphore(window)
+        self._window        = window
+        self._pending       = collections.deque()
+        self._failure       = None
+        self._is_closed     = False
+
+        self._pool    = multiprocessing.Pool(processes)
+        self._results = self._pool.imap(_render_task, self._tasks())
+
+    def __iter__ (self) :
+        return self
+
+    def _tasks (self) :
+        ''' This is read by the pool's own thread. '''
+
+        while True :
+            self._slots.acquire()
+            if self._is_closed :
+                return
+
+            try :
+                message = next(self._messages)
+            except StopIteration :
+                return
+            except Exception as exception :
+                # This is raised to the reader once everything before it has
+                # been yielded.
+                self._failure = exception
+                return
+
+            self._pending.append(message)
+            yield (message, self._eight_bit, self._keep_literal,
+                   self._should_render(message))
+
+    def next (self) :
+        try :
+            rendered = next(self._results)
+        except StopIteration :
+            self.close()
+            if self._failure is not None :
+                raise self._failure
+
+            raise
+        except Exception :
+            # The message couldn't be handed to a worker process.
+            rendered = None
+
+        self._slots.release()
+        return self._pending.popleft(), rendered
+
+    def close (self) :
+        ''' This stops rendering, and the worker processes. '''
+
+        if self._is_closed :
+            return
+
+        self._is_closed = True
+
+        # The pool's thread may be waiting for a slot.
+        for _ in xrange(self._window + 1) :
+            self._slots.release()
+
+        self._pool.terminate()
+        self._pool.join()
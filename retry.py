@@ -0,0 +1,47 @@
+''' This module contains the retry policy <EmailServer> uses for messages
+    which fail for a temporary reason (a 4xx reply, or a dropped connection),
+    so a batch carries on over a new connection rather than stopping. '''
+
+
+import email_lib.transport as transport
+
+__all__ = ['RetryPolicy']
+
+class RetryPolicy (object) :
+    ''' How many times, and how soon, a message is tried again.
+
+        <max_tries>    : The most times a single message is tried, including
+                         the first.
+        <backoff>      : The number of seconds before the first retry, which
+                         doubles for each retry after that.
+        <max_backoff>  : The longest wait between retries.
+        <is_retryable> : A function which is given the exception a message
+                         failed with, and tells if it's worth trying again.
+                         By default 4xx replies and connection problems are
+                         (<email_lib.transport.is_transient>), and 5xx
+                         replies aren't. '''
+
+    def __init__ (self, max_tries=3, backoff=1.0, max_backoff=30.0,
+                  is_retryable=None) :
+        if max_tries < 1 :
+            raise ValueError('A message has to be tried at least once.')
+
+        if is_retryable is None :
+            is_retryable = transport.is_transient
+
+        self.max_tries    = max_tries
+        self.backoff      = backoff
+        self.max_backoff  = max_backoff
+        self.is_retryable = is_retryable
+
+    def should_retry (self, exception, tries) :
+        ''' Should a message which has been tried <tries> times, and last
+            failed with <exception>, be tried again? '''
+
+        return tries < self.max_tries and self.is_retryable(exception)
+
+    def delay (self, tries) :
+        ''' The number of seconds to wait before trying a message again,
+            after it has been tried <tries> times. '''
+
+        return min(self.backoff * 2 ** (tries - 1), self.max_backoff)
@@ -0,0 +1,328 @@
+''' This module contains a durable outbox (spool) for messages, along with a
+    worker which delivers the spooled messages through an <EmailServer>.
+    Putting a message in the spool only pickles it to a file, so callers
+    don't have to wait on the server at all. '''
+
+
+import os
+import time
+import uuid
+import errno
+import threading
+import cPickle as pickle
+
+import email_lib.transport as transport
+
+__all__ = ['Spool', 'SpoolWorker']
+
+class Spool (object) :
+    ''' A queue of messages kept in a directory, in the style of a Maildir.
+        Entries are written to <tmp>, and moved into <new> once complete.
+        Workers claim entries by moving them into <cur>, which is atomic, so
+        any number of worker processes can share a spool. Entries which
+        can't be delivered are moved into <failed>.
+
+        Each entry's file name starts with the time it's due to be sent, and
+        the number of attempts made so far.
+
+        <path> : The spool's directory, which is created if necessary.
+        <sync> : If this is true, entries are flushed to disk before <put>
+                 returns. Without this, a message survives the process dying,
+                 but not the machine losing power. '''
+
+    _directories = ('tmp', 'new', 'cur', 'failed')
+
+    def __init__ (self, path, sync=False) :
+        self.path = path
+        self.sync = sync
+
+        for directory in self._directories :
+            try :
+                os.makedirs(os.path.join(path, directory))
+            except OSError as exception :
+                if exception.errno != errno.EEXIST :
+                    raise
+
+    def __len__ (self) :
+        ''' The number of messages waiting to be sent (including the ones
+            being sent now). '''
+
+        depth = self.depth()
+        return depth['new'] + depth['cur']
+
+    def _file_name (self, directory, name) :
+        return os.path.join(self.path, directory, name)
+
+    def _name (self, due, attempts, unique=None) :
+        if unique is None :
+            unique = uuid.uuid4().hex
+
+        return '%017.6f-%d-%s' % (due, attempts, unique)
+
+    def _parse (self, name) :
+        due, attempts, unique = name.split('-', 2)
+        return float(due), int(attempts), unique
+
+    def _write (self, message, name) :
+        temporary = self._file_name('tmp', name)
+        with open(temporary, 'wb') as spool_file :
+            pickle.dump(message, spool_file, pickle.HIGHEST_PROTOCOL)
+
+            if self.sync :
+                spool_file.flush()
+                os.fsync(spool_file.fileno())
+
+        os.rename(temporary, self._file_name('new', name))
+
+    def put (self, message, delay=0) :
+        ''' This adds <message> to the spool, to be sent in <delay> seconds,
+            and returns the entry's name. '''
+
+        name = self._name(time.time() + delay, 0)
+        self._write(message, name)
+
+        return name
+
+    def claim (self, limit=None) :
+        ''' This claims up to <limit> entries which are due, and returns them
+            as a list of <(name, message)> tuples. Every claimed entry must be
+            passed to <done>, <retry> or <fail> afterwards. Entries which
+            can't be unpickled are moved straight into <failed>. '''
+
+        now     = time.time()
+        claimed = []
+
+        for name in sorted(os.listdir(self._file_name('new', ''))) :
+            if limit is not None and len(claimed) >= limit :
+                break
+
+            try :
+                due = self._parse(name)[0]
+            except ValueError :
+                continue
+
+            if due > now :
+                # Names are sorted by due time, so nothing later is due.
+                break
+
+            current = self._file_name('cur', name)
+            try :
+                os.rename(self._file_name('new', name), current)
+            except OSError :
+                # Another worker claimed it first.
+                continue
+
+            # The modification time records when the entry was claimed.
+            os.utime(current, None)
+
+            try :
+                with open(current, 'rb') as spool_file :
+                    message = pickle.load(spool_file)
+            except Exception :
+                # An entry which can't be read (e.g., a truncated file, or a
+                # class which no longer exists) could never be sent, and
+                # shouldn't hold up the entries claimed with it.
+                self.fail(name)
+                continue
+
+            claimed.append((name, message))
+
+        return claimed
+
+    def done (self, name) :
+        ''' This removes a claimed entry, once it has been sent. '''
+
+        os.remove(self._file_name('cur', name))
+
+    def retry (self, name, delay, message=None) :
+        ''' This puts a claimed entry back, to be sent again in <delay>
+            seconds. If <message> is given, it replaces the spooled
+            message. '''
+
+        _, attempts, unique = self._parse(name)
+        new_name = self._name(time.time() + delay, attempts + 1, unique)
+
+        if message is None :
+            os.rename(self._file_name('cur', name),
+                      self._file_name('new', new_name))
+        else :
+            self._write(message, new_name)
+            os.remove(self._file_name('cur', name))
+
+        return new_name
+
+    def fail (self, name) :
+        ''' This moves a claimed entry into <failed>, where it's kept for
+            inspection but not sent again. '''
+
+        os.rename(self._file_name('cur', name),
+                  self._file_name('failed', name))
+
+    def attempts (self, name) :
+        ''' The number of failed attempts made to send an entry. '''
+
+        return self._parse(name)[1]
+
+    def recover (self, lease=600.0) :
+        ''' This puts back entries which were claimed more than <lease>
+            seconds ago, e.g., by a worker that crashed, and returns how many
+            there were. '''
+
+        now       = time.time()
+        recovered = 0
+
+        for name in os.listdir(self._file_name('cur', '')) :
+            current = self._file_name('cur', name)
+            try :
+                if now - os.path.getmtime(current) <= lease :
+                    continue
+
+                os.rename(current, self._file_name('new', name))
+            except OSError :
+                # It was finished (or recovered) in the mean time.
+                continue
+            else :
+                recovered += 1
+
+        return recovered
+
+    def depth (self) :
+        ''' This returns the number of entries in each state, along with the
+            number of waiting entries which are due now. '''
+
+        now = time.time()
+        new = os.listdir(self._file_name('new', ''))
+
+        due = 0
+        for name in new :
+            try :
+                if self._parse(name)[0] <= now :
+                    due += 1
+            except ValueError :
+                continue
+
+        return {'new'    : len(new),
+                'due'    : due,
+                'cur'    : len(os.listdir(self._file_name('cur', ''))),
+                'failed' : len(os.listdir(self._file_name('failed', '')))}
+
+class SpoolWorker (object) :
+    ''' This delivers the messages in a <Spool> through an <EmailServer>.
+        Temporary failures (4xx replies, and connection problems) are retried
+        with an exponential backoff. Recipients which were temporarily
+        refused are retried on their own.
+
+        <spool>        : The <Spool> object.
+        <server>       : The <EmailServer> object. Giving it a positive
+                         <max_idle> lets the worker keep its connections open
+                         between batches.
+        <batch_size>   : The most entries claimed at once.
+        <workers>      : The number of concurrent connections used to send
+                         each batch.
+        <max_attempts> : The number of attempts made before an entry fails.
+        <backoff>      : The number of seconds before the first retry, which
+                         doubles for each retry after that.
+        <max_backoff>  : The longest wait between retries.
+        <lease>        : Entries claimed longer ago than this many seconds are
+                         assumed to belong to a crashed worker, and are put
+                         back in the spool.
+        <poll_interval> : The number of seconds to wait when the spool is
+                          empty. '''
+
+    def __init__ (self, spool, server, batch_size=100, workers=1,
+                  max_attempts=5, backoff=60.0, max_backoff=3600.0,
+                  lease=600.0, poll_interval=1.0) :
+        self.spool         = spool
+        self.server        = server
+        self.batch_size    = batch_size
+        self.workers       = workers
+        self.max_attempts  = max_attempts
+        self.backoff       = backoff
+        self.max_backoff   = max_backoff
+        self.lease         = lease
+        self.poll_interval = poll_interval
+
+        self.last_exception = None
+
+        self._stopping = threading.Event()
+        self._thread   = None
+
+    def _delay (self, name) :
+        attempts = self.spool.attempts(name)
+        return min(self.backoff * 2 ** attempts, self.max_backoff)
+
+    def _retry_or_fail (self, name, message=None) :
+        if self.spool.attempts(name) + 1 >= self.max_attempts :
+            self.spool.fail(name)
+        else :
+            self.spool.retry(name, self._delay(name), message)
+
+    def _handle (self, name, result) :
+        if result.succeeded() :
+            deferred = [recipient
+                        for recipient, (code, _) in result.errors.iteritems()
+                        if transport.is_transient_code(code)]
+
+            if deferred :
+                # The message is sent again, to just these recipients.
+                message    = result.message
+                message.to = deferred
+                self._retry_or_fail(name, message)
+            else :
+                self.spool.done(name)
+        elif transport.is_transient(result.exception) :
+            self._retry_or_fail(name)
+        else :
+            self.spool.fail(name)
+
+    def run_once (self) :
+        ''' This sends one batch of due entries, and returns how many there
+            were. '''
+
+        self.spool.recover(self.lease)
+
+        claimed = self.spool.claim(self.batch_size)
+        if not claimed :
+            return 0
+
+        results = self.server.send([message for _, message in claimed],
+                                   workers=self.workers)
+
+        for (name, _), result in zip(claimed, results) :
+            self._handle(name, result)
+
+        return len(claimed)
+
+    def run (self) :
+        ''' This keeps sending entries until <stop> is called. A batch which
+            raises an exception doesn't stop the worker, the exception is
+            kept in <last_exception>, and the batch's entries are put back
+            once their lease runs out. '''
+
+        while not self._stopping.is_set() :
+            try :
+                sent = self.run_once()
+            except Exception as exception :
+                self.last_exception = exception
+                sent                = 0
+
+            if not sent :
+                self._stopping.wait(self.poll_interval)
+
+    def start (self) :
+        ''' This runs the worker in a background thread. '''
+
+        self._stopping.clear()
+
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop (self, wait=True) :
+        ''' This stops the worker after its current batch. '''
+
+        self._stopping.set()
+
+        if wait and self._thread is not None :
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,191 @@
+''' This module contains the mail merge template class, which makes many
+    personalized messages from a single template, and rows of values. '''
+
+
+import string
+
+import email_lib.constants as constants
+import email_lib.lib as lib
+
+__all__ = ['MessageTemplate']
+
+class _CompiledText (object) :
+    ''' A text containing <string.Template> style fields ($name or ${name}),
+        which is split into its literal parts and field names once, so that
+        filling it in is a single join.
+
+        The charset needed by the literal parts is worked out up front as
+        well, so only the substituted values have to be checked later. '''
+
+    def __init__ (self, text) :
+        text = unicode(text)
+
+        self.literals = []
+        self.names    = []
+
+        literal = []
+        start   = 0
+        for match in string.Template.pattern.finditer(text) :
+            literal.append(text[start:match.start()])
+            start = match.end()
+
+            if match.group('escaped') is not None :
+                literal.append(match.group('escaped'))
+            elif match.group('invalid') is not None :
+                raise ValueError('Invalid placeholder in template text, at '
+                                 'character %d.' % match.start())
+            else :
+                self.literals.append(u''.join(literal))
+                self.names.append(match.group('named') or
+                                  match.group('braced'))
+                literal = []
+
+        literal.append(text[start:])
+        self.literals.append(u''.join(literal))
+
+        self.encoding = lib.Message._encoding(u''.join(self.literals))
+
+    def fill (self, row) :
+        ''' This returns the text with its fields filled in from <row> (a
+            mapping), along with the charset the result needs. '''
+
+        if not self.names :
+            return self.literals[0], self.encoding
+
+        values = [unicode(row[name]) for name in self.names]
+
+        parts = [None] * (len(self.literals) + len(values))
+        parts[0::2] = self.literals
+        parts[1::2] = values
+
+        encoding = _wider(self.encoding,
+                          lib.Message._encoding(u''.join(values)))
+
+        return u''.join(parts), encoding
+
+def _wider (*encodings) :
+    ''' Of the charsets given, this returns the one which is latest in
+        <constants.ENCODINGS>, which can encode anything the others can. '''
+
+    return max(encodings, key=constants.ENCODINGS.index)
+
+class _MadeAttachment (object) :
+    ''' An attachment which has already been made once (for each kind of
+        server, see <Attachment.make>), and is shared by all of a template's
+        messages. Anything besides making it is passed on to the original
+        <Attachment>. '''
+
+    _is_attachment = True
+
+    def __init__ (self, attachment) :
+        self.attachment = attachment
+
+        self._made       = {False : attachment.make()}
+        self._made_state = attachment._state()
+
+    def __getattr__ (self, name) :
+        if name == 'attachment' :
+            # This isn't set yet, e.g., while unpickling.
+            raise AttributeError(name)
+
+        return getattr(self.attachment, name)
+
+    def _state (self) :
+        return self._made_state
+
+    def make (self, eight_bit=False) :
+        made = self._made.get(eight_bit)
+        if made is None :
+            made = self._made[eight_bit] = self.attachment.make(eight_bit)
+
+        return made
+
+class _TemplateMessage (lib.Message) :
+    ''' A message made by a <MessageTemplate>, whose body charset is already
+        known. '''
+
+    def __init__ (self, from_, to, subject, body, attachments,
+                  body_encoding) :
+        lib.Message.__init__(self, from_, to, subject, body, attachments)
+
+        self._body_encoding = body_encoding
+
+    def _encoding (self, text) :
+        if text is self.body :
+            return self._body_encoding
+
+        return lib.Message._encoding(text)
+
+class MessageTemplate (object) :
+    ''' This class makes personalized <Message> objects from rows of values
+        (mappings, such as dicts). The template is parsed, and the attachments
+        are made, only once rather than once per message.
+
+        <from_>       : The "from" address.
+        <to>          : The recipient address, or a list of addresses.
+        <subject>     : The message's subject text.
+        <body>        : The text that comprises the message's body.
+        <attachments> : A single <Attachment> object, or a list of them, which
+                        are attached (unchanged) to every message.
+
+        Any of the texts may contain <string.Template> style fields, e.g.,
+        <$name> or <${name}>, which are filled in from each row. A literal
+        dollar sign is written as <$$>. '''
+
+    def __init__ (self, from_, to, subject=u'', body=u'', attachments=()) :
+        self.from_       = from_
+        self.to          = to
+        self.subject     = subject
+        self.body        = body
+        self.attachments = attachments
+
+        self._compiled = None
+
+    def _compile (self) :
+        if isinstance(self.to, basestring) :
+            to = _CompiledText(self.to)
+        else :
+            to = [_CompiledText(recipient) for recipient in self.to]
+
+        attachments = lib.Message._attachment_list(self.attachments)
+        attachments = [_MadeAttachment(attachment)
+                       for attachment in attachments]
+
+        self._compiled = (_CompiledText(self.from_),
+                          to,
+                          _CompiledText(self.subject),
+                          _CompiledText(self.body),
+                          attachments)
+
+    def recompile (self) :
+        ''' This parses the template, and makes its attachments again. This is
+            needed after the template's attributes have been changed. '''
+
+        self._compile()
+
+    def render (self, row) :
+        ''' This returns a <Message> object, with the template's fields filled
+            in from <row>. '''
+
+        if self._compiled is None :
+            self._compile()
+
+        from_, to, subject, body, attachments = self._compiled
+
+        if isinstance(to, list) :
+            to = [recipient.fill(row)[0] for recipient in to]
+        else :
+            to = to.fill(row)[0]
+
+        body, body_encoding = body.fill(row)
+
+        return _TemplateMessage(from_.fill(row)[0], to, subject.fill(row)[0],
+                                body, attachments, body_encoding)
+
+    def messages (self, rows) :
+        ''' This lazily yields a <Message> object for every row in the
+            iterable <rows>, so rows can be read (e.g., from a file or a
+            database cursor) as messages are sent. '''
+
+        for row in rows :
+            yield self.render(row)
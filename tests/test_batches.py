@@ -0,0 +1,48 @@
+''' Tests of sending a message's recipients in batches, with a fake <send>
+    which replies from a script. '''
+
+
+import smtplib
+import unittest
+
+import email_lib
+
+_BATCHES = [['a@example.com', 'b@example.com'], ['c@example.com']]
+
+class BatchTest (unittest.TestCase) :
+
+    def setUp (self) :
+        # Nothing is connected to.
+        self.server = email_lib.EmailServer('127.0.0.1', 1, tls=None)
+
+    def send_batches (self, replies, progress=None) :
+        ''' Each batch is answered with the next of <replies>, which is
+            either its refused recipients or an exception to raise. '''
+
+        replies = list(replies)
+
+        def send (batch) :
+            reply = replies.pop(0)
+            if isinstance(reply, Exception) :
+                raise reply
+
+            return reply
+
+        return self.server._send_batches(send, _BATCHES, progress)
+
+    def test_sender_refused_after_a_batch_went_out (self) :
+        refused  = smtplib.SMTPSenderRefused(452, 'Too many', 'from')
+        progress = {}
+        errors   = self.send_batches([{}, refused], progress)
+
+        self.assertEqual(errors, {'c@example.com' : (452, 'Too many')})
+        self.assertEqual(progress, {0 : {}})
+
+    def test_sender_refused_first (self) :
+        refused = smtplib.SMTPSenderRefused(530, 'Auth', 'from')
+
+        with self.assertRaises(smtplib.SMTPSenderRefused) :
+            self.send_batches([refused])
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,45 @@
+''' Tests of sending coalesced messages, against the benchmark sink. '''
+
+
+import unittest
+
+import email_lib
+import email_lib.lib as lib
+from email_lib.bench.sink import SMTPSink
+
+class CoalesceTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.sink = SMTPSink(tls=None)
+        self.sink.start()
+
+        self.server = email_lib.EmailServer('127.0.0.1', self.sink.port,
+                                            tls=None)
+
+    def tearDown (self) :
+        self.server.close()
+        self.sink.stop()
+
+    def message (self, to, body=u'Body', attachments=()) :
+        return email_lib.Message('sender@example.com', to, u'Subject', body,
+                                 attachments)
+
+    def test_serial_failure_gives_original_results (self) :
+        # The first and third messages are merged, the last can't be made.
+        bad      = lib.Attachment(__file__, 'plain', 'bogus')
+        messages = [self.message('one@example.com'),
+                    self.message('two@example.com', u'Other'),
+                    self.message('three@example.com'),
+                    self.message('four@example.com', attachments=[bad])]
+
+        with self.assertRaises(ValueError) as context :
+            self.server.send(messages, coalesce=True)
+
+        results = context.exception.results
+        self.assertEqual([result.message for result in results],
+                         messages[:3])
+        self.assertTrue(all(result.succeeded() for result in results))
+        self.assertEqual(self.sink.stats['transactions'], 2)
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,35 @@
+''' Tests of connecting to a server which doesn't answer, against the
+    benchmark sink. '''
+
+
+import time
+import unittest
+
+import email_lib
+import email_lib.pool as pool
+from email_lib.bench.sink import SMTPSink
+
+class TimeoutTest (unittest.TestCase) :
+
+    def setUp (self) :
+        # The sink is too slow to reply within the timeout.
+        self.sink = SMTPSink(tls=None, latency=2.0)
+        self.sink.start()
+
+    def tearDown (self) :
+        self.sink.stop()
+
+    def test_silent_server_times_out (self) :
+        server  = email_lib.EmailServer('127.0.0.1', self.sink.port, tls=None,
+                                        timeout=0.2)
+        message = email_lib.Message('sender@example.com', 'to@example.com')
+
+        start  = time.time()
+        result = server.send(message, workers=1)[0]
+
+        # <smtplib> reports a timed out reply as a lost connection.
+        self.assertIsInstance(result.exception, pool.CONNECTION_ERRORS)
+        self.assertTrue(time.time() - start < 1.5)
+
+if __name__ == '__main__' :
+    unittest.main()
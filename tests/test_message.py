@@ -0,0 +1,33 @@
+''' Tests of made messages, which are cached between sends. '''
+
+
+import unittest
+import email.Utils
+
+import email_lib
+
+class DateTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.formatdate = email.Utils.formatdate
+        self.date       = 'Mon, 05 Oct 2026 10:00:00 +0000'
+
+        email.Utils.formatdate = lambda *args, **kwargs : self.date
+
+    def tearDown (self) :
+        email.Utils.formatdate = self.formatdate
+
+    def test_reused_message_is_dated_again (self) :
+        message = email_lib.Message('sender@example.com', 'to@example.com',
+                                    u'Subject', u'Body ' * 1000)
+        first   = str(message)
+
+        old, self.date = self.date, 'Mon, 05 Oct 2026 10:00:05 +0000'
+        second = str(message)
+
+        self.assertIn('\nDate: %s\n' % self.date, second)
+        self.assertEqual(first.replace(old, self.date), second)
+        self.assertEqual(message.make()['Date'], self.date)
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,71 @@
+''' Tests of failing over between the relays of a <RelayGroup>, against the
+    benchmark sink. '''
+
+
+import socket
+import unittest
+
+import email_lib
+from email_lib.bench.sink import SMTPSink
+
+def _closed_port () :
+    ''' A port which nothing is listening on. '''
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+
+    return port
+
+class FailoverTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.sink = SMTPSink(tls=None)
+        self.sink.start()
+
+        self.recorder = email_lib.MetricsRecorder()
+        self.good     = email_lib.EmailServer('127.0.0.1', self.sink.port,
+                                              tls=None)
+        self.down     = email_lib.EmailServer('127.0.0.1', _closed_port(),
+                                              tls=None,
+                                              metrics=self.recorder)
+
+    def tearDown (self) :
+        self.sink.stop()
+
+    def messages (self, count) :
+        return [email_lib.Message('sender@example.com',
+                                  'to%d@example.com' % index, u'Subject',
+                                  u'Body')
+                for index in xrange(count)]
+
+    def test_fails_over_to_healthy_relay (self) :
+        group   = email_lib.RelayGroup([self.down, self.good])
+        results = group.send(self.messages(10), workers=2)
+
+        self.assertTrue(all(result.succeeded() for result in results))
+        self.assertEqual(self.sink.stats['transactions'], 10)
+
+        stats = dict((relay['name'], relay) for relay in group.stats())
+        down  = stats['127.0.0.1:%d' % self.down.port]
+        self.assertFalse(down['up'])
+        self.assertEqual(down['sent'], 0)
+        self.assertTrue(down['failed'] >= 1)
+
+    def test_runs_out_of_relays (self) :
+        # There are fewer relays than <max_tries>.
+        group = email_lib.RelayGroup([self.down], max_tries=3)
+
+        for workers in (None, 2) :
+            results = group.send(self.messages(3), workers=workers)
+
+            self.assertEqual(len(results), 3)
+            for result in results :
+                self.assertIsInstance(result.exception, socket.error)
+
+        counts = self.recorder.snapshot()['counts']
+        self.assertEqual(counts['messages_failed'], 6)
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,86 @@
+''' Tests of streamed messages which fail, against the benchmark sink. A
+    failed message mustn't leave its connection inside DATA, where the next
+    message's commands would be taken as part of it. '''
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import email_lib
+import email_lib.lib as lib
+from email_lib.bench.sink import SMTPSink
+
+class _BrokenAttachment (lib.Attachment) :
+    ''' An attachment whose file can't be read after its headers. '''
+
+    def stream (self, chunk_size=None, eight_bit=False) :
+        yield 'Content-Type: text/plain\n\n'
+        raise IOError('The disk went away.')
+
+class StreamFailureTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.directory = tempfile.mkdtemp(prefix='email_lib-test-')
+        self.path      = os.path.join(self.directory, 'attachment.txt')
+        with open(self.path, 'w') as attachment_file :
+            attachment_file.write('Some text.\n' * 100)
+
+        self.sink = SMTPSink(tls=None)
+        self.sink.start()
+
+        # Every message is streamed, and connections are kept between them.
+        self.server = email_lib.EmailServer('127.0.0.1', self.sink.port,
+                                            tls=None, max_idle=60.0,
+                                            stream_threshold=1)
+
+    def tearDown (self) :
+        self.server.close()
+        self.sink.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def message (self, attachment) :
+        return email_lib.Message('sender@example.com', 'to@example.com',
+                                 u'Subject', u'Body', [attachment])
+
+    def send (self, messages) :
+        ''' This sends <messages> one at a time, and returns their results,
+            failing if it takes too long (i.e., the server is stuck waiting
+            for the rest of a message). '''
+
+        results = []
+        thread  = threading.Thread(
+                      target=lambda : results.extend(
+                                          result for _, result in
+                                          self.server.send_iter(messages)))
+        thread.daemon = True
+        thread.start()
+        thread.join(10.0)
+
+        self.assertFalse(thread.is_alive(), 'The send got stuck.')
+        return results
+
+    def test_bad_attachment_fails_before_data (self) :
+        bad     = self.message(lib.Attachment(self.path, 'plain', 'bogus'))
+        results = self.send([bad, self.message(lib.Attachment(self.path))])
+
+        self.assertIsInstance(results[0].exception, ValueError)
+        self.assertTrue(results[1].succeeded())
+        self.assertEqual(self.sink.stats['transactions'], 1)
+
+        # Nothing was started, so the connection was kept.
+        self.assertEqual(self.sink.stats['connections'], 1)
+
+    def test_failure_during_data_discards_connection (self) :
+        bad     = self.message(_BrokenAttachment(self.path))
+        results = self.send([bad, self.message(lib.Attachment(self.path))])
+
+        self.assertIsInstance(results[0].exception, IOError)
+        self.assertTrue(results[1].succeeded())
+        self.assertEqual(self.sink.stats['transactions'], 1)
+        self.assertEqual(self.sink.stats['connections'], 2)
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,113 @@
+''' Tests of the envelope reply handling in <email_lib.transport>, against a
+    fake connection which replies from a script. '''
+
+
+import smtplib
+import unittest
+
+import email_lib.transport as transport
+
+class _FakeServer (object) :
+    ''' Enough of an <smtplib.SMTP> object for <transport>. Replies are taken
+        in order from <replies>, and everything written is kept. '''
+
+    def __init__ (self, replies, pipelining=True) :
+        self.replies    = list(replies)
+        self.written    = []
+        self.resets     = 0
+        self.does_esmtp = True
+
+        self._extensions = set(['pipelining'] if pipelining else [])
+
+    def ehlo_or_helo_if_needed (self) :
+        pass
+
+    def has_extn (self, name) :
+        return name.lower() in self._extensions
+
+    def send (self, data) :
+        self.written.append(str(data))
+
+    def putcmd (self, command, args='') :
+        self.send('%s %s\r\n' % (command, args))
+
+    def getreply (self) :
+        return self.replies.pop(0)
+
+    def docmd (self, command, args='') :
+        self.putcmd(command, args)
+        return self.getreply()
+
+    def rcpt (self, recipient) :
+        return self.docmd('rcpt', 'TO:%s' % smtplib.quoteaddr(recipient))
+
+    def rset (self) :
+        self.resets += 1
+        return (250, 'OK')
+
+_OK = (250, 'OK')
+_GO = (354, 'Go ahead')
+_TO = ['x@example.com', 'y@example.com']
+
+class PipelinedEnvelopeTest (unittest.TestCase) :
+
+    def send (self, replies, pipelining=True) :
+        server = _FakeServer(replies, pipelining)
+        result = transport.sendmail(server, 'a@example.com', _TO, 'Hi\n')
+
+        return server, result
+
+    def test_accepted (self) :
+        server, refused = self.send([_OK, _OK, _OK, _GO, _OK])
+
+        self.assertEqual(refused, {})
+        self.assertEqual(server.resets, 0)
+        self.assertEqual(server.replies, [])
+
+        # The envelope is written at once, before any reply is read.
+        self.assertEqual(server.written[0].count('\r\n'), 4)
+
+    def test_some_recipients_refused (self) :
+        server, refused = self.send([_OK, _OK, (550, 'No'), _GO, _OK])
+
+        self.assertEqual(refused, {'y@example.com' : (550, 'No')})
+        self.assertEqual(server.resets, 0)
+
+    def test_data_refused (self) :
+        for pipelining in (True, False) :
+            replies = [_OK, _OK, _OK, (451, 'Try later')]
+            server  = _FakeServer(replies, pipelining)
+
+            with self.assertRaises(smtplib.SMTPDataError) as caught :
+                transport.sendmail(server, 'a@example.com', _TO, 'Hi\n')
+
+            self.assertEqual(caught.exception.smtp_code, 451)
+
+            # Otherwise the next transaction's MAIL is a nested one.
+            self.assertEqual(server.resets, 1)
+            self.assertEqual(server.replies, [])
+
+    def test_sender_refused (self) :
+        replies = [(530, 'Auth'), (503, 'No'), (503, 'No'), (503, 'No')]
+        server  = _FakeServer(replies)
+
+        with self.assertRaises(smtplib.SMTPSenderRefused) :
+            transport.sendmail(server, 'a@example.com', _TO, 'Hi\n')
+
+        self.assertEqual(server.resets, 1)
+        self.assertEqual(server.replies, [])
+
+    def test_every_recipient_refused (self) :
+        # The server wants the data anyway, so it's ended straight away.
+        replies = [_OK, (550, 'No'), (550, 'No'), _GO, (554, 'No')]
+        server  = _FakeServer(replies)
+
+        with self.assertRaises(smtplib.SMTPRecipientsRefused) :
+            transport.sendmail(server, 'a@example.com', _TO, 'Hi\n')
+
+        self.assertEqual(server.written[-1], '.\r\n')
+        self.assertEqual(server.resets, 1)
+        self.assertEqual(server.replies, [])
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,142 @@
+''' This module chooses the Content-Transfer-Encoding of a MIME part from its
+    content (and from whether the server takes 8-bit data), and encodes parts
+    with it. The content is looked over once, a chunk at a time, rather than
+    being encoded each possible way to find the smallest. '''
+
+
+import re
+import quopri
+import email.Encoders
+
+__all__ = ['SEVEN_BIT', 'EIGHT_BIT', 'QUOTED_PRINTABLE', 'BASE64',
+           'MAX_LINE_LENGTH', 'Scanner', 'choose', 'encode', 'encode_chunks']
+
+SEVEN_BIT        = '7bit'
+EIGHT_BIT        = '8bit'
+QUOTED_PRINTABLE = 'quoted-printable'
+BASE64           = 'base64'
+
+''' The longest line allowed in 7bit and 8bit data, not counting its line
+    ending (RFC 5322 pg 7). '''
+MAX_LINE_LENGTH = 998
+
+_FROM = re.compile('^From ', re.MULTILINE)
+
+_HIGH_BYTES = ''.join(chr(byte) for byte in xrange(0x80, 0x100))
+
+''' The other bytes quoted-printable escapes. Tabs and spaces are only
+    escaped at the end of a line, which is rare enough to leave out. '''
+_ESCAPED_BYTES = ''.join(chr(byte) for byte in xrange(0x20)
+                         if chr(byte) not in '\t\n\r') + '=\x7f'
+
+class Scanner (object) :
+    ''' This looks over content a chunk at a time, and keeps what's needed to
+        choose its transfer encoding. '''
+
+    def __init__ (self) :
+        self.size    = 0
+        self.high    = 0
+        self.escaped = 0
+        self.has_nul = False
+        self.longest = 0
+
+        # The length of the line which the last chunk ended in the middle of.
+        self._line = 0
+
+    def update (self, chunk) :
+        self.size += len(chunk)
+
+        low           = chunk.translate(None, _HIGH_BYTES)
+        self.high    += len(chunk) - len(low)
+        self.escaped += len(low) - len(low.translate(None, _ESCAPED_BYTES))
+
+        if '\0' in chunk :
+            self.has_nul = True
+
+        lines = chunk.split('\n')
+        if len(lines) == 1 :
+            self._line += len(chunk)
+            self.longest = max(self.longest, self._line)
+        else :
+            self.longest = max(self.longest, self._line + len(lines[0]),
+                               max(map(len, lines[1:])))
+            self._line   = len(lines[-1])
+
+        return self
+
+    def choose (self, eight_bit=False) :
+        ''' This returns the transfer encoding which keeps the content
+            smallest. <8bit> is only chosen if <eight_bit> is true, i.e., the
+            server supports 8BITMIME. '''
+
+        if not self.has_nul and self.longest <= MAX_LINE_LENGTH :
+            if not self.high :
+                return SEVEN_BIT
+            elif eight_bit :
+                return EIGHT_BIT
+
+        # The sizes are estimated : quoted-printable escapes take 3 bytes,
+        # and its lines are broken every 76 bytes or so. Base64 takes 4 bytes
+        # for every 3, with a newline every 76 bytes.
+        quoted_printable = (self.size + 2 * (self.high + self.escaped) +
+                            self.size // 25)
+        base64           = (self.size + 2) // 3 * 4 + self.size // 57
+
+        if quoted_printable <= base64 :
+            return QUOTED_PRINTABLE
+        else :
+            return BASE64
+
+def choose (data, eight_bit=False) :
+    ''' This returns the transfer encoding which keeps the string <data>
+        smallest (see <Scanner.choose>). '''
+
+    return Scanner().update(data).choose(eight_bit)
+
+def encode (part, data, transfer_encoding) :
+    ''' This sets the MIME object <part>'s payload to the string <data>,
+        encoded with <transfer_encoding>, along with its
+        Content-Transfer-Encoding header. '''
+
+    if transfer_encoding == BASE64 :
+        part.set_payload(data)
+        email.Encoders.encode_base64(part)
+        return part
+
+    if transfer_encoding == QUOTED_PRINTABLE :
+        data = quopri.encodestring(data)
+
+    part.set_payload(data)
+
+    del part['Content-Transfer-Encoding']
+    part['Content-Transfer-Encoding'] = transfer_encoding
+
+    return part
+
+def encode_chunks (lines, transfer_encoding, chunk_size) :
+    ''' This encodes an iterable of lines with <transfer_encoding> (apart
+        from base64, which has to be read in blocks), yielding chunks of
+        about <chunk_size> bytes. Lines starting with "From " are escaped
+        just as <email.Generator> escapes them. The chunks hold whole lines,
+        so joined together they're the same as the lines encoded all at
+        once. '''
+
+    def encoded (chunk) :
+        data = ''.join(chunk)
+        if transfer_encoding == QUOTED_PRINTABLE :
+            data = quopri.encodestring(data)
+
+        return _FROM.sub('>From ', data)
+
+    chunk = []
+    size  = 0
+    for line in lines :
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size :
+            yield encoded(chunk)
+            chunk = []
+            size  = 0
+
+    if chunk :
+        yield encoded(chunk)
@@ -0,0 +1,326 @@
+''' This module contains lower level SMTP transaction helpers, which work on
+    top of connected <smtplib.SMTP> objects. '''
+
+
+import re
+import time
+import socket
+import smtplib
+
+from email_lib.metrics import NULL_METRICS
+
+__all__ = ['quote_chunks', 'quote', 'sendmail', 'send_quoted', 'send_parts',
+           'send_stream', 'supports_eight_bit', 'is_transient']
+
+CRLF = '\r\n'
+
+''' Smaller pieces of a message are joined together before being written. '''
+_MIN_WRITE = 64 * 1024
+
+''' The end of data marker. '''
+_END = '.' + CRLF
+
+_LINE_ENDING = re.compile(r'(?:\r\n|\n|\r(?!\n))')
+
+def quote_chunks (chunks) :
+    ''' This is a streaming version of <smtplib.quotedata>. Line endings in
+        <chunks> are changed to CRLF, and leading dots are doubled, even when
+        a line is split across chunks. The final line is always terminated
+        (as it is by <smtplib.SMTP.data>), so the end of data marker can
+        simply follow. '''
+
+    pending       = ''
+    at_line_start = True
+    is_empty      = True
+
+    for chunk in chunks :
+        data = pending + chunk
+
+        # A trailing CR might be the first half of a CRLF.
+        if data.endswith('\r') :
+            pending = '\r'
+            data    = data[:-1]
+        else :
+            pending = ''
+
+        if not data :
+            continue
+
+        data = _LINE_ENDING.sub(CRLF, data).replace(CRLF + '.', CRLF + '..')
+        if at_line_start and data.startswith('.') :
+            data = '.' + data
+
+        at_line_start = data.endswith(CRLF)
+        is_empty      = False
+
+        yield data
+
+    if pending or is_empty or not at_line_start :
+        yield CRLF
+
+def _start_data_pipelined (server, from_, to, options) :
+    ''' With PIPELINING, MAIL, every RCPT and DATA are written at once, and
+        their replies are read afterwards. '''
+
+    commands = ['mail FROM:%s%s' % (smtplib.quoteaddr(from_), options)]
+    commands.extend('rcpt TO:%s' % smtplib.quoteaddr(recipient)
+                    for recipient in to)
+    commands.append('data')
+
+    server.send(''.join(command + CRLF for command in commands))
+
+    mail_code, mail_response = server.getreply()
+
+    refused = {}
+    for recipient in to :
+        code, response = server.getreply()
+        if code not in (250, 251) :
+            refused[recipient] = (code, response)
+
+    code, response = server.getreply()
+
+    is_valid = mail_code == 250 and len(refused) < len(to)
+    if code == 354 and not is_valid :
+        # The server wants the data anyway, so it's ended straight away.
+        server.send(_END)
+        server.getreply()
+
+    if mail_code != 250 :
+        server.rset()
+        raise smtplib.SMTPSenderRefused(mail_code, mail_response, from_)
+
+    if len(refused) == len(to) :
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    if code != 354 :
+        # Otherwise the next MAIL would be refused as nested in this one.
+        server.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    return refused
+
+def _start_data_serially (server, from_, to, options) :
+    code, response = server.docmd('mail', 'FROM:%s%s'
+                                          % (smtplib.quoteaddr(from_),
+                                             options))
+    if code != 250 :
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, response, from_)
+
+    refused = {}
+    for recipient in to :
+        code, response = server.rcpt(recipient)
+        if code not in (250, 251) :
+            refused[recipient] = (code, response)
+
+    if len(refused) == len(to) :
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    server.putcmd('data')
+    code, response = server.getreply()
+    if code != 354 :
+        server.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    return refused
+
+def supports_eight_bit (server) :
+    ''' This tells if the server takes 8bit message content (8BITMIME). '''
+
+    server.ehlo_or_helo_if_needed()
+    return bool(server.does_esmtp and server.has_extn('8bitmime'))
+
+def _start_data (server, from_, to, size=None, eight_bit=False) :
+    ''' This sends the envelope (MAIL and RCPT) and DATA commands, and
+        returns the dict of refused recipients once the server is ready for
+        the message. The same exceptions as <smtplib.SMTP.sendmail> are
+        raised. '''
+
+    server.ehlo_or_helo_if_needed()
+
+    options = ''
+    if size is not None and server.does_esmtp and server.has_extn('size') :
+        options = ' size=%d' % size
+
+    if eight_bit :
+        options += ' BODY=8BITMIME'
+
+    if server.does_esmtp and server.has_extn('pipelining') :
+        return _start_data_pipelined(server, from_, to, options)
+    else :
+        return _start_data_serially(server, from_, to, options)
+
+def _end_data (server, quoted) :
+    ''' This writes the message, and returns how many bytes were written. '''
+
+    # Small pieces (such as the final CRLF) are held back and written along
+    # with the end of data marker. Written on their own, each small write
+    # would wait on the server's delayed ACK of the one before it (Nagle).
+    pending = []
+    size    = 0
+    written = 0
+    for data in quoted :
+        pending.append(data)
+        size += len(data)
+
+        if size >= _MIN_WRITE :
+            server.send(''.join(pending))
+            written += size
+            pending  = []
+            size     = 0
+
+    pending.append(_END)
+    server.send(''.join(pending))
+    written += size
+
+    _check_end(server)
+
+    return written
+
+def _end_quoted (server, payload) :
+    server.send(payload)
+    _check_end(server)
+
+    return len(payload)
+
+def _end_parts (server, parts) :
+    written = 0
+    pending = []
+    for part in parts :
+        written += len(part)
+        if len(part) < _MIN_WRITE :
+            pending.append(part)
+        else :
+            # Small parts go out with the start of a large one (see
+            # <_end_data>), and the rest of it is written straight from the
+            # string, without being copied.
+            server.send(''.join(pending) + part[:_MIN_WRITE])
+            server.send(memoryview(part)[_MIN_WRITE:])
+            pending = []
+
+    if pending :
+        server.send(''.join(pending))
+
+    _check_end(server)
+
+    return written
+
+def _check_end (server) :
+    code, response = server.getreply()
+    if code != 250 :
+        server.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+def _transact (server, from_, to, size, end, metrics, eight_bit) :
+    if metrics is None :
+        metrics = NULL_METRICS
+
+    start   = time.time()
+    refused = _start_data(server, from_, to, size, eight_bit)
+    metrics.timing('envelope', time.time() - start)
+
+    start = time.time()
+    try :
+        written = end()
+    except smtplib.SMTPResponseException :
+        # The server replied, so the session is still in step.
+        raise
+    except :
+        # The server is still waiting for the rest of the message, and would
+        # take whatever is written next as part of it, so the connection
+        # can't be used again.
+        server.close()
+        raise
+
+    metrics.timing('data', time.time() - start, written)
+
+    return refused
+
+def quote (message) :
+    ''' This returns the string <message> as it's written after DATA, in a
+        single piece : with CRLF line endings, leading dots doubled, and the
+        end of data marker. It can be sent with <send_quoted> any number of
+        times.
+
+        Messages made by the <email> package only have LF line endings, and
+        hardly ever a line starting with a dot, which takes a single
+        <str.replace> (rather than the regular expression <quote_chunks>
+        uses). '''
+
+    if '\r' in message :
+        quoted = ''.join(quote_chunks([message]))
+    else :
+        quoted = message.replace('\n', CRLF)
+        if '\n.' in message :
+            quoted = quoted.replace(CRLF + '.', CRLF + '..')
+
+        if quoted.startswith('.') :
+            quoted = '.' + quoted
+
+        if not quoted.endswith(CRLF) :
+            quoted += CRLF
+
+    return quoted + _END
+
+def send_quoted (server, from_, to, payload, metrics=None,
+                 eight_bit=False) :
+    ''' This performs a mail transaction like <sendmail>, with a message
+        already quoted by <quote>. '''
+
+    return _transact(server, from_, to, len(payload),
+                     lambda : _end_quoted(server, payload), metrics,
+                     eight_bit)
+
+def send_parts (server, from_, to, parts, metrics=None, eight_bit=False) :
+    ''' This performs a mail transaction like <send_quoted>, with the quoted
+        message given as a list of strings which are written one after
+        another (the last ending with the end of data marker). They aren't
+        joined together first, so a large part shared by many messages isn't
+        copied for each of them. '''
+
+    return _transact(server, from_, to, sum(len(part) for part in parts),
+                     lambda : _end_parts(server, parts), metrics, eight_bit)
+
+def sendmail (server, from_, to, message, metrics=None, eight_bit=False) :
+    ''' This performs a mail transaction just like <smtplib.SMTP.sendmail>,
+        except that if the server supports PIPELINING, the envelope is sent
+        in a single round trip. The same dict of refused recipients is
+        returned, and the same exceptions are raised. The <envelope> and
+        <data> phases are timed with <metrics>, if it's given. With
+        <eight_bit> the message is declared as 8bit content (BODY=8BITMIME),
+        which the server has to support (see <supports_eight_bit>). '''
+
+    return send_quoted(server, from_, to, quote(message), metrics, eight_bit)
+
+def send_stream (server, from_, to, chunks, metrics=None, eight_bit=False) :
+    ''' This performs a mail transaction like <sendmail>, except that the
+        message is taken from the iterable <chunks> and written to the
+        connection a chunk at a time, so it's never held in memory as a
+        whole. '''
+
+    return _transact(server, from_, to, None,
+                     lambda : _end_data(server, quote_chunks(chunks)),
+                     metrics, eight_bit)
+
+''' Exceptions which are worth trying again later. '''
+TRANSIENT_ERRORS = (socket.error,
+                    smtplib.SMTPServerDisconnected,
+                    smtplib.SMTPConnectError)
+
+def is_transient_code (code) :
+    return 400 <= code < 500
+
+def is_transient (exception) :
+    ''' This tells if a failed send is worth trying again later (perhaps
+        through another relay), i.e., it was a connection problem, or a 4xx
+        reply. '''
+
+    if isinstance(exception, smtplib.SMTPRecipientsRefused) :
+        return all(is_transient_code(code)
+                   for code, _ in exception.recipients.itervalues())
+    elif isinstance(exception, smtplib.SMTPResponseException) :
+        return is_transient_code(exception.smtp_code)
+    else :
+        return isinstance(exception, TRANSIENT_ERRORS)
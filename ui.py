@@ -2,13 +2,19 @@
     interface (a command-line interface). '''
 
 
+import os
 import sys
+import csv
+import json
+import time
 import getpass
-import mimetypes
+import argparse
+import itertools
 
 import email_lib
+import email_lib.mime_types as mime_types
 
-__all__ = ['cli']
+__all__ = ['cli', 'batch']
 
 class CLI (object) :
     ''' A command-line interface class, this allows the user to send a single
@@ -123,7 +129,7 @@ class CLI (object) :
             if self.ask_mime_type :
                 type_ = raw_input('MIME content-type : ') or None
             else :
-                guessed_type = mimetypes.guess_type(path)[0]
+                guessed_type = mime_types.guess_type(path)[0]
                 if guessed_type is None :
                     type_ = raw_input('MIME content-type : ')
                 else :
@@ -236,6 +242,254 @@ def __run__ (print_hist=False, *args, **kw) :
 
         sys.exit(0)
 
+class BatchCLI (object) :
+    ''' A non-interactive interface, which sends every message in a manifest
+        file, and writes the outcome of each to a results file. The manifest
+        is read (and its messages are made) a chunk at a time, so its size
+        doesn't matter.
+
+        A manifest is either a CSV file with a header row, or a JSONL file
+        (one JSON object per line). Each row has these fields :
+
+            <from>        : The "from" address.
+            <to>          : The recipient addresses (separated by semicolons
+                            in a CSV file, or a list in a JSONL file).
+            <subject>     : The subject text.
+            <body>        : The body text, or ...
+            <body_file>   : ... the name of a file holding the body text.
+            <attachments> : Attachment file names (separated by semicolons,
+                            or a list). Text files are read as plain text,
+                            anything else as binary.
+            <id>          : An optional identifier, copied to the results.
+
+        <server>            : The <EmailServer> object used.
+        <workers>           : The number of concurrent connections.
+        <chunk_size>        : The number of rows read (and messages held) at
+                              once.
+        <progress_interval> : The number of seconds between progress reports.
+        <output>            : Where progress is reported (a file object). '''
+
+    _results_header = ['row', 'id', 'status', 'refused', 'error']
+
+    def __init__ (self, server, workers=1, chunk_size=1000,
+                  progress_interval=5.0, output=sys.stderr) :
+        self.server            = server
+        self.workers           = workers
+        self.chunk_size        = chunk_size
+        self.progress_interval = progress_interval
+        self.output            = output
+
+    def _rows (self, manifest_file, format_) :
+        ''' This yields the manifest's rows unparsed (see <_parse>), so a
+            row which can't be parsed only fails itself. '''
+
+        if format_ == 'csv' :
+            reader = csv.reader(manifest_file)
+            header = [name.strip().lower() for name in next(reader)]
+            for values in reader :
+                yield header, values
+        else :
+            for line in manifest_file :
+                if line.strip() :
+                    yield line
+
+    def _parse (self, raw, format_) :
+        ''' This returns the dict of a row yielded by <_rows>. '''
+
+        if format_ == 'csv' :
+            header, values = raw
+            return dict(zip(header, [value.decode('utf8')
+                                     for value in values]))
+
+        row = json.loads(raw)
+        if not isinstance(row, dict) :
+            raise ValueError('A JSONL row should be an object.')
+
+        return row
+
+    def _list (self, value) :
+        if value is None :
+            return []
+        elif isinstance(value, basestring) :
+            return [item.strip() for item in value.split(';') if item.strip()]
+        else :
+            return list(value)
+
+    def _attachment (self, path) :
+        type_ = mime_types.guess_type(path)[0]
+        if type_ is not None and type_.startswith('text/') :
+            read_mode = 'plain'
+        else :
+            read_mode = 'binary'
+
+        return email_lib.Attachment(path, read_mode, type_)
+
+    def _message (self, row) :
+        ''' This makes a <Message> object from a manifest row. '''
+
+        body = row.get('body') or u''
+        if row.get('body_file') :
+            with open(row['body_file'], 'r') as f :
+                body = f.read().decode('utf8')
+
+        to = self._list(row.get('to'))
+        if not row.get('from') or not to :
+            raise ValueError('A row needs a "from" and a "to" address.')
+
+        attachments = [self._attachment(path)
+                       for path in self._list(row.get('attachments'))]
+
+        return email_lib.Message(row['from'], to, row.get('subject') or u'',
+                                 body, attachments)
+
+    def _report (self, sent, failed, start) :
+        elapsed = time.time() - start
+        rate    = (sent + failed) / elapsed if elapsed else 0.0
+
+        self.output.write('Sent %d, failed %d, %.1f messages/s\n'
+                          % (sent, failed, rate))
+        self.output.flush()
+
+    def _write (self, writer, values) :
+        writer.writerow([unicode(value).encode('utf8') for value in values])
+
+    def _result_row (self, number, row, result) :
+        refused = ';'.join(sorted(result.errors))
+        if result.succeeded() :
+            return [number, row.get('id', ''), 'sent', refused, '']
+        else :
+            return [number, row.get('id', ''), 'failed', refused,
+                    repr(result.exception)]
+
+    def run (self, manifest_path, results_path, format_=None) :
+        ''' This sends every message in the manifest, and returns a dict with
+            the number <sent> and <failed>, and the number of <seconds> it
+            took. <format_> is <'csv'> or <'jsonl'>, by default it's
+            guessed from the manifest's file name. '''
+
+        if format_ is None :
+            if manifest_path.lower().endswith('.csv') :
+                format_ = 'csv'
+            else :
+                format_ = 'jsonl'
+
+        sent   = 0
+        failed = 0
+        start  = time.time()
+        report = start + self.progress_interval
+
+        with open(manifest_path, 'rb') as manifest_file, \
+             open(results_path, 'wb') as results_file :
+            writer = csv.writer(results_file)
+            writer.writerow(self._results_header)
+
+            rows = enumerate(self._rows(manifest_file, format_), 1)
+            while True :
+                chunk = list(itertools.islice(rows, self.chunk_size))
+                if not chunk :
+                    break
+
+                # Rows which can't be parsed, or made into messages, fail on
+                # their own.
+                made     = []
+                parsed   = []
+                outcomes = []
+                for number, raw in chunk :
+                    row = {}
+                    try :
+                        row = self._parse(raw, format_)
+                        made.append(self._message(row))
+                    except (ValueError, TypeError, IOError,
+                            KeyError) as exception :
+                        outcomes.append(email_lib.SendResult(
+                                            None, exception=exception))
+                    else :
+                        outcomes.append(None)
+
+                    parsed.append((number, row))
+
+                results = iter(self.server.send(made, workers=self.workers))
+
+                for (number, row), outcome in zip(parsed, outcomes) :
+                    if outcome is None :
+                        outcome = next(results)
+
+                    self._write(writer, self._result_row(number, row,
+                                                         outcome))
+                    if outcome.succeeded() :
+                        sent += 1
+                    else :
+                        failed += 1
+
+                if time.time() >= report :
+                    self._report(sent, failed, start)
+                    report = time.time() + self.progress_interval
+
+        self._report(sent, failed, start)
+
+        return {'sent'    : sent,
+                'failed'  : failed,
+                'seconds' : time.time() - start}
+
+def batch (manifest_path, results_path, host, port, username=None,
+           password=None, workers=1, format_=None, tls='starttls',
+           max_tries=3, **kw) :
+    ''' This sends every message in a manifest file (see <BatchCLI>)
+        without prompting for anything, and returns a dict with the number
+        <sent> and <failed>. <tls> is passed on to <EmailServer>, messages
+        which fail for a temporary reason are tried up to <max_tries> times,
+        and other keyword arguments are passed on to <BatchCLI>. '''
+
+    server = email_lib.EmailServer(host, port, username, password,
+                                   pool_size=workers, max_idle=60.0, tls=tls,
+                                   retry=email_lib.RetryPolicy(max_tries))
+    try :
+        return BatchCLI(server, workers, **kw).run(manifest_path,
+                                                   results_path, format_)
+    finally :
+        server.close()
+
+def _batch_main (arguments) :
+    ''' The command-line entry point for <batch>. The password is taken from
+        the <EMAIL_LIB_PASSWORD> environment variable, or prompted for, so it
+        doesn't show up in the process list. '''
+
+    parser = argparse.ArgumentParser(prog='python -m email_lib.ui',
+                                     description='Send every message in a '
+                                                 'CSV or JSONL manifest.')
+    parser.add_argument('manifest')
+    parser.add_argument('results')
+    parser.add_argument('--host', required=True)
+    parser.add_argument('--port', type=int, default=587)
+    parser.add_argument('--username')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--format', choices=['csv', 'jsonl'])
+    parser.add_argument('--tls', choices=['starttls', 'implicit', 'none'],
+                        default='starttls',
+                        help="'implicit' is for SMTPS (usually port 465)")
+    parser.add_argument('--max-tries', type=int, default=3,
+                        help='how many times a message which fails for a '
+                             'temporary reason is tried')
+
+    options = parser.parse_args(arguments)
+
+    password = None
+    if options.username is not None :
+        password = (os.environ.get('EMAIL_LIB_PASSWORD') or
+                    getpass.getpass('Password : '))
+
+    summary = batch(options.manifest, options.results, options.host,
+                    options.port, options.username, password, options.workers,
+                    options.format,
+                    None if options.tls == 'none' else options.tls,
+                    options.max_tries, chunk_size=options.chunk_size)
+
+    return 0 if summary['failed'] == 0 else 1
+
 if __name__ == '__main__' :
-    __run__()
+    if len(sys.argv) > 1 :
+        sys.exit(_batch_main(sys.argv[1:]))
+    else :
+        __run__()
 